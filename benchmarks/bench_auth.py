@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measures requests per second through the authentication layer, for a client
+with valid credentials and for one guessing passwords, comparing the static
+password check used before with the BasicAuth middleware using a hashed
+password, with and without throttling of failed attempts.
+
+Usage: python benchmarks/bench_auth.py
+"""
+
+import time
+import base64
+import logging
+from webob import Request
+from webob.dec import wsgify
+from webob import exc
+from yubiadmin.util.basicauth import BasicAuth, hash_password
+
+USERNAME = 'yubiadmin'
+PASSWORD = 'yubiadmin'
+
+
+@wsgify
+def ok_app(request):
+    return 'OK'
+
+
+def legacy_auth(app):
+    """
+    The check done for each request before BasicAuth.
+    """
+    valid = base64.b64encode('%s:%s' % (USERNAME, PASSWORD))
+
+    @wsgify
+    def check(request):
+        if request.authorization:
+            _, auth = request.authorization
+            if valid == auth:
+                return request.get_response(app)
+        response = exc.HTTPUnauthorized()
+        response.www_authenticate = ('Basic', {'realm': 'bench'})
+        return response
+    return check
+
+
+def request(app, password, address):
+    auth = base64.b64encode('%s:%s' % (USERNAME, password))
+    return Request.blank('/', environ={
+        'REMOTE_ADDR': address,
+        'HTTP_AUTHORIZATION': 'Basic ' + auth
+    }).get_response(app).status_int
+
+
+def rate(func, seconds=1.0):
+    count = 0
+    start = time.time()
+    while time.time() - start < seconds:
+        func()
+        count += 1
+    return count / (time.time() - start)
+
+
+def attack(app):
+    """
+    Alternates wrong passwords from one address with valid requests from
+    another, returning the rate of each and the statuses seen. The attacker
+    has already used up any allowance for failed attempts.
+    """
+    for i in range(getattr(app, 'failure_burst', 0)):
+        request(app, 'guess', '10.0.0.1')
+    statuses = set()
+    legit = []
+
+    def step():
+        statuses.add(request(app, 'guess', '10.0.0.1'))
+        start = time.time()
+        assert request(app, PASSWORD, '10.0.0.2') == 200
+        legit.append(time.time() - start)
+    total = rate(step, 2.0)
+    return total, sum(legit) / len(legit), sorted(statuses)
+
+
+def main():
+    logging.basicConfig(level=logging.ERROR)
+    hashed = hash_password(PASSWORD)
+    apps = [
+        ('legacy', legacy_auth(ok_app)),
+        ('hashed, uncached', BasicAuth(ok_app, USERNAME, hashed, 'bench',
+                                       cache_ttl=0)),
+        ('hashed, cached', BasicAuth(ok_app, USERNAME, hashed, 'bench')),
+    ]
+    print('Valid credentials:')
+    for name, app in apps:
+        assert request(app, PASSWORD, '10.0.0.2') == 200
+        print('  %-24s %10.0f req/s' % (name, rate(
+            lambda: request(app, PASSWORD, '10.0.0.2'))))
+
+    apps = [
+        ('legacy', legacy_auth(ok_app)),
+        ('hashed, unthrottled', BasicAuth(ok_app, USERNAME, hashed, 'bench',
+                                          failure_burst=0)),
+        ('hashed, throttled', BasicAuth(ok_app, USERNAME, hashed, 'bench')),
+    ]
+    print('Under attack (one guess per valid request):')
+    for name, app in apps:
+        pairs, latency, statuses = attack(app)
+        print('  %-24s %10.0f req/s %8.2fms valid %s' % (
+            name, pairs * 2, latency * 1000, statuses))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+
+"""
+Times the config parsing primitives used by every form load and save, on
+synthetic files of increasing size, and estimates how their running time
+grows with the size of the input. Fails if any primitive grows faster than
+its stored baseline allows, or faster than MAX_EXPONENT, so that quadratic
+regressions are caught before they reach a large config file.
+
+Usage: python benchmarks/bench_config_primitives.py [--save] [--quick]
+
+--save stores the results as the new baseline, --quick stops at 1 MB.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import platform
+from yubiadmin.util import config
+from yubiadmin.util.config import (parse_block, strip_comments, parse_value,
+                                   python_handler, python_list_handler,
+                                   PHPHandler, PHPIndex)
+from yubiadmin.apps.val import KSMHandler
+from yubiadmin.apps.freerad import parse_clients
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baselines', 'config_primitives.json')
+
+SIZES = [1 << 10, 10 << 10, 100 << 10, 300 << 10, 1 << 20, 3 << 20,
+         10 << 20]
+
+# Growth is estimated from sizes of at least this, smaller inputs are
+# dominated by constant overhead. It isn't estimated from fewer than
+# MIN_POINTS sizes.
+FIT_FROM = 100 << 10
+MIN_POINTS = 3
+
+# Linear is 1.0, quadratic 2.0. Allow for noise and O(n log n).
+MAX_EXPONENT = 1.3
+TOLERANCE = 0.25
+
+# Minimum time to spend on, and number of runs for, each measurement.
+MIN_TIME = 0.05
+MIN_REPEATS = 5
+
+
+def repeat(text, size):
+    """
+    Repeats text, numbered, until it is at least size bytes long.
+    """
+    parts = []
+    total = 0
+    i = 0
+    while total < size:
+        part = text % {'i': i}
+        parts.append(part)
+        total += len(part)
+        i += 1
+    return ''.join(parts)
+
+
+def php_array(size):
+    return repeat("\t'key%(i)d' => array(\"a\", 'b (%(i)d)', 3), "
+                  "// entry %(i)d\n", size) + ');\n$other = 1;'
+
+
+def comments(size):
+    return repeat("/* Block comment %(i)d\n * spanning lines, with 'quotes'"
+                  "\n */\n$a%(i)d = \"# not a comment\"; # comment\n"
+                  "// line comment %(i)d\n", size)
+
+
+def python_conf(size):
+    return repeat('# Setting %(i)d, described at some length so that the '
+                  'file is mostly comments\nSETTING_%(i)d = "value %(i)d"\n',
+                  size) + 'TARGET = "old"\n'
+
+
+def python_list(size):
+    return 'OTHER = 1\nTARGET = [\n' + repeat(
+        '    "https://server%(i)d.example.com/wsapi/2.0/verify",\n',
+        size) + ']\nLAST = 2\n'
+
+
+def php_params(size):
+    return '<?php\n$baseParams = array();\n' + repeat(
+        "# Local addition %(i)d (see ticket #%(i)d; it's needed).\n"
+        "/* Disabled:\n$baseParams['__OLD_%(i)d__'] = \"old\";\n*/\n"
+        "$baseParams['__LOCAL_%(i)d__'] = array('a' => \"x;y\", 'b' => "
+        "%(i)d);\n", size) + "$baseParams['__TARGET__'] = \"old\";\n?>\n"
+
+
+def ksm_config(size):
+    return '<?php\n' + repeat("# Comment %(i)d, about the KSM setup.\n",
+                              size // 2) + \
+        'function otp2ksmurls ($otp, $client) {\n\treturn array(\n' + \
+        repeat('\t\t"http://ksm%(i)d.example.com/wsapi/decrypt?otp=$otp",\n',
+               size // 2) + '\t);\n}\n?>\n'
+
+
+def clients_conf(size):
+    return repeat('# NAS %(i)d\nclient nas-%(i)d {\n\tipaddr = 10.0.0.1\n'
+                  '\tsecret = s3cret-%(i)d\n\tlimit {\n\t\tlifetime = 0\n'
+                  '\t}\n}\n', size)
+
+
+target = python_handler('TARGET', None)
+target_list = python_list_handler('TARGET', [])
+ksm = KSMHandler()
+php_target = PHPHandler('baseParams', lambda x:
+                        '$baseParams[\'__TARGET__\'] = "%s";' % x,
+                        parse_value, key='__TARGET__')
+
+
+def uncached(func):
+    # php_index() reuses the index built for the very same string, which
+    # would leave only the first repeat of a read doing any work.
+    def wrapper(content):
+        config._last_index = None
+        return func(content)
+    return wrapper
+
+# Name, input generator, and function of the input.
+PRIMITIVES = [
+    ('parse_block', php_array, parse_block),
+    ('strip_comments', comments, strip_comments),
+    ('parse_value', lambda size: '"%s"' % ('x' * size), parse_value),
+    ('RegexHandler.read', python_conf, target.read),
+    ('RegexHandler.write', python_conf,
+     lambda content: target.write(content, 'new')),
+    ('python_list_handler.read', python_list, target_list.read),
+    ('python_list_handler.write', python_list,
+     lambda content: target_list.write(content, ['a', 'b'])),
+    ('PHPIndex', php_params, PHPIndex),
+    ('PHPHandler.read', php_params, uncached(php_target.read)),
+    ('PHPHandler.write', php_params,
+     uncached(lambda content: php_target.write(content, 'new'))),
+    ('KSMHandler.read', ksm_config, ksm.read),
+    ('KSMHandler.write', ksm_config,
+     lambda content: ksm.write(content, ['http://ksm/wsapi/decrypt'])),
+    ('parse_clients', clients_conf,
+     lambda content: list(parse_clients(content))),
+]
+
+
+def measure(func, arg):
+    """
+    Returns the best time of running func(arg), repeated at least
+    MIN_REPEATS times and for at least MIN_TIME.
+    """
+    best = None
+    total = 0
+    repeats = 0
+    while total < MIN_TIME or repeats < MIN_REPEATS:
+        start = time.time()
+        func(arg)
+        elapsed = time.time() - start
+        total += elapsed
+        repeats += 1
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def exponent(sizes, times):
+    """
+    The slope of log(time) against log(size), by least squares.
+    """
+    points = [(math.log(s), math.log(max(t, 1e-9)))
+              for s, t in zip(sizes, times) if s >= FIT_FROM]
+    if len(points) < MIN_POINTS:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / \
+        sum((x - mean_x) ** 2 for x, _ in points)
+
+
+def run(sizes):
+    results = {}
+    print('%-28s %s %9s' % ('', ' '.join('%9s' % format_size(s)
+                                          for s in sizes), 'growth'))
+    for name, generate, func in PRIMITIVES:
+        times = []
+        for size in sizes:
+            times.append(measure(func, generate(size)))
+        growth = exponent(sizes, times)
+        results[name] = {'sizes': sizes, 'times': times, 'exponent': growth}
+        print('%-28s %s %9s' % (name, ' '.join(
+            '%7.2fms' % (t * 1000) for t in times),
+            'n^%.2f' % growth if growth is not None else '-'))
+        sys.stdout.flush()
+    return results
+
+
+def format_size(size):
+    if size >= 1 << 20:
+        return '%dMB' % (size >> 20)
+    return '%dKB' % (size >> 10)
+
+
+def check(results, baseline):
+    """
+    Returns a list of primitives which have become asymptotically slower.
+    """
+    failures = []
+    for name, result in sorted(results.items()):
+        growth = result['exponent']
+        if growth is None:
+            continue
+        allowed = MAX_EXPONENT
+        if name in baseline and baseline[name]['exponent'] is not None:
+            # Measured growth below linear is noise, don't hold it to that.
+            allowed = min(allowed, max(1.0, baseline[name]['exponent']) +
+                          TOLERANCE)
+        if growth > allowed:
+            failures.append('%s grows as n^%.2f, allowed n^%.2f' % (
+                name, growth, allowed))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--save', action='store_true',
+                        help='Store the results as the new baseline')
+    parser.add_argument('--quick', action='store_true',
+                        help='Stop at 1 MB')
+    args = parser.parse_args()
+
+    sizes = [s for s in SIZES if not args.quick or s <= 1 << 20]
+    results = run(sizes)
+
+    if args.save:
+        if not os.path.isdir(os.path.dirname(BASELINE)):
+            os.makedirs(os.path.dirname(BASELINE))
+        with open(BASELINE, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'results': results
+            }, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Baseline written to %s' % BASELINE)
+        return
+
+    baseline = {}
+    if os.path.isfile(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)['results']
+    else:
+        print('No baseline found, checking against n^%.1f only' %
+              MAX_EXPONENT)
+    failures = check(results, baseline)
+    for failure in failures:
+        print('FAIL: %s' % failure)
+    if failures:
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compares parsing a FreeRADIUS clients.conf holding many NAS entries with the
+previous parser, which re-joined the rest of the file for every client, to
+the single pass parser, and to looking up the cached index.
+
+Usage: python benchmarks/bench_freerad_clients.py
+"""
+
+import timeit
+from yubiadmin.util.config import parse_block
+from yubiadmin.apps.freerad import (parse_client, parse_clients,
+                                    index_clients, CLIENT)
+from yubiadmin.util.config import CachedFile
+
+SIZES = [10, 100, 1000, 5000]
+
+HEADER = """#
+# clients.conf - client configuration directives
+#
+client localhost {
+\tipaddr = 127.0.0.1
+\tsecret = testing123
+\trequire_message_authenticator = no
+\tnastype = other
+}
+"""
+
+CLIENT_BLOCK = """
+# NAS %(i)d, rack %(r)d
+client nas-%(i)d {
+\tipaddr = 10.%(r)d.%(n)d.1
+\tsecret = s3cret-%(i)d  # rotated yearly
+\tshortname = nas-%(i)d
+\tnastype = cisco
+\tlimit {
+\t\tmax_connections = 16
+\t\tlifetime = 0
+\t}
+}
+"""
+
+
+def legacy_parse_clients(content):
+    """
+    The parser used before the single pass parse_clients.
+    """
+    lines = content.splitlines()
+    index = 0
+    skip = 0
+    for line in lines:
+        if skip > 0:
+            skip -= 1
+            continue
+
+        match = CLIENT.match(line.strip())
+        if match:
+            name = match.group(1)
+            c_content = parse_block('\n'.join(lines[index + 1:]), '{', '}')
+            client = parse_client(name, c_content)
+            skip = len(c_content.splitlines())
+            client['id'] = index
+            client['start'] = index
+            client['end'] = index + skip + 2
+            index += skip
+            yield client
+
+        index += 1
+
+
+def best(func, number):
+    return min(timeit.repeat(func, repeat=3, number=number)) / number
+
+
+def main():
+    print('%8s %10s %12s %12s %12s' % ('clients', 'bytes', 'legacy',
+                                       'single pass', 'cached'))
+    for size in SIZES:
+        content = unicode(HEADER + ''.join(
+            [CLIENT_BLOCK % {'i': i, 'r': i // 250, 'n': i % 250}
+             for i in range(size)]))
+        legacy = list(legacy_parse_clients(content))
+        current = list(parse_clients(content))
+        for client in current:
+            del client['label']
+        assert legacy == current
+        entry = CachedFile(None, content)
+        number = max(1, 1000 // size)
+        print('%8d %10d %10.3fms %10.3fms %10.3fms' % (
+            size + 1, len(content),
+            best(lambda: list(legacy_parse_clients(content)),
+                 max(1, number // 10)) * 1000,
+            best(lambda: list(parse_clients(content)), number) * 1000,
+            best(lambda: entry.memo(index_clients)[:10], number) * 1000
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Compares reading all ykval-config.php parameters, and writing all the scalar
+ones, using one regex scan per parameter against the single pass PHPIndex, on
+generated config files padded with hand-edited looking sections.
+
+Usage: python benchmarks/bench_php_config.py
+"""
+
+import re
+import timeit
+from yubiadmin.util.config import RegexHandler, php_inserter
+from yubiadmin.apps.val import ykval_config, yk_parse_arraystring
+
+SIZES = [10, 100, 1000, 10000]
+
+TEMPLATE = """<?php
+$baseParams = array ();
+$baseParams['__YKVAL_DB_DSN__'] = "mysql:dbname=ykval;host=127.0.0.1";
+%s
+$baseParams['__YKVAL_SYNC_POOL__'] = array(
+	"http://api2.example.com/wsapi/2.0/sync",
+	"http://api3.example.com/wsapi/2.0/sync"
+);
+$baseParams['__YKVAL_ALLOWED_SYNC_POOL__'] = array("10.0.0.2", "10.0.0.3");
+$baseParams['__YKVAL_SYNC_INTERVAL__'] = 10;
+$baseParams['__YKVAL_SYNC_RESYNC_TIMEOUT__'] = 30;
+$baseParams['__YKVAL_SYNC_OLD_LIMIT__'] = 10;
+$baseParams['__YKVAL_SYNC_FAST_LEVEL__'] = 1;
+$baseParams['__YKVAL_SYNC_SECURE_LEVEL__'] = 40;
+$baseParams['__YKVAL_SYNC_DEFAULT_LEVEL__'] = 60;
+$baseParams['__YKVAL_SYNC_DEFAULT_TIMEOUT__'] = 1;
+
+function otp2ksmurls ($otp, $client) {
+  return array("http://localhost/wsapi/decrypt?otp=$otp");
+}
+?>
+"""
+
+SECTION = """
+# Local addition %(i)d, see ticket #%(i)d (do not remove; it's needed).
+/* Disabled for now:
+$baseParams['__LOCAL_%(i)d__'] = "old";
+*/
+$baseParams['__LOCAL_%(i)d__'] = array('a' => "x;y", 'b' => %(i)d);
+"""
+
+
+def legacy_handlers():
+    """
+    The per-parameter regex handlers used before PHPIndex.
+    """
+    def pattern(varname, prefix='', suffix='', flags=None):
+        regex = r'(?m)^(?!#)\$baseParams\[\'__YKVAL_%s__\'\]\s*=' \
+            '\s*%s(.*?)%s\s*;\s*$' % (varname, prefix, suffix)
+        if flags:
+            regex = '(?%s)' % flags + regex
+        return regex
+
+    def write(varname):
+        return lambda x: '$baseParams[\'__YKVAL_%s__\'] = %s;' % (varname, x)
+
+    handlers = [RegexHandler(pattern(name), write(name),
+                             inserter=php_inserter)
+                for name in ['SYNC_DEFAULT_LEVEL', 'SYNC_SECURE_LEVEL',
+                             'SYNC_FAST_LEVEL', 'SYNC_DEFAULT_TIMEOUT',
+                             'SYNC_INTERVAL', 'SYNC_RESYNC_TIMEOUT',
+                             'SYNC_OLD_LIMIT']]
+    for name in ['SYNC_POOL', 'ALLOWED_SYNC_POOL']:
+        handlers.append(RegexHandler(
+            pattern(name, 'array\(', '\)', 's'), write(name),
+            lambda match: yk_parse_arraystring(match.group(1)),
+            php_inserter, []))
+    return handlers
+
+
+def read_all(handlers, content):
+    # Copy the string so that no cached index can be reused between runs.
+    content = (content + ' ')[:-1]
+    return [handler.read(content) for handler in handlers]
+
+
+def write_all(handlers, content):
+    content = (content + ' ')[:-1]
+    for handler in handlers:
+        content = handler.write(content, 99)
+    return content
+
+
+def best(func, number):
+    return min(timeit.repeat(func, repeat=3, number=number)) / number
+
+
+def main():
+    legacy = legacy_handlers()
+    current = [ykval_config.params[key] for key in ykval_config.params
+               if key != 'ksm_urls']
+
+    print('%8s %10s %12s %12s %12s %12s' % (
+        'sections', 'bytes', 'read regex', 'read index', 'write regex',
+        'write index'))
+    scalars = len(legacy) - 2
+    for size in SIZES:
+        content = unicode(TEMPLATE % ''.join(
+            [SECTION % {'i': i} for i in range(size)]))
+        assert read_all(legacy, content) == read_all(current, content)
+        assert read_all(current, write_all(legacy[:scalars], content)) == \
+            read_all(current, write_all(current[:scalars], content))
+        number = max(1, 1000 // size)
+        print('%8d %10d %10.3fms %10.3fms %10.3fms %10.3fms' % (
+            size, len(content),
+            best(lambda: read_all(legacy, content), number) * 1000,
+            best(lambda: read_all(current, content), number) * 1000,
+            best(lambda: write_all(legacy[:scalars], content), number) * 1000,
+            best(lambda: write_all(current[:scalars], content), number) * 1000
+        ))
+
+
+if __name__ == '__main__':
+    main()
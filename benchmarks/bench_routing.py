@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measures the per-request overhead of looking up the app for a request, by
+inspecting every app as was done before the app registry, and by using the
+registry. Also measures a complete in-process request for the system page.
+
+Usage: python benchmarks/bench_routing.py
+"""
+
+import timeit
+from collections import OrderedDict
+from webob import Request
+from yubiadmin.apps import apps, registry
+from yubiadmin.server import application
+from yubiadmin.util.registry import app_doc
+
+
+loaded_apps = [app.load() for app in apps]
+
+
+def legacy_route(name):
+    """
+    The lookup done for each request before the app registry.
+    """
+    apps_data = OrderedDict()
+    for app in loaded_apps:
+        title, desc = app_doc(app)
+        apps_data[app.name] = (app, {
+            'name': app.name,
+            'title': title,
+            'description': desc,
+            'disabled': bool(getattr(app, 'disabled', False)),
+            'hidden': bool(getattr(app, 'hidden', False))
+        })
+    modules = [data for (_, data) in apps_data.values()]
+    return apps_data[name], modules
+
+
+def registry_route(name):
+    return registry.get(name), registry.snapshot()
+
+
+def request(path):
+    return Request.blank(path, environ={'REMOTE_ADDR': '127.0.0.1'}) \
+        .get_response(application)
+
+
+def best(func, number):
+    return min(timeit.repeat(func, repeat=3, number=number)) / number
+
+
+def main():
+    assert request('/sys/general').status_int == 200
+    number = 10000
+    print('%-24s %10s' % ('', 'per call'))
+    print('%-24s %8.2fus' % ('legacy lookup', best(
+        lambda: legacy_route('sys'), number) * 1000000))
+    print('%-24s %8.2fus' % ('registry lookup', best(
+        lambda: registry_route('sys'), number) * 1000000))
+    print('%-24s %8.2fus' % ('GET /sys/general', best(
+        lambda: request('/sys/general'), 100) * 1000000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+
+"""
+Drives the complete application in-process through webob, against a
+temporary tree of fixture config files and with stub commands on PATH, and
+reports throughput and p50/p99 latency for the dashboard, every section of
+every app, form submissions and paginated lists. The results are also
+written as JSON, so that releases can be compared.
+
+Usage: python benchmarks/bench_wsgi.py [-n REQUESTS] [-o FILE] [-k]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+CLIENTS = 2000
+RADIUS_CLIENTS = 1000
+
+YUBIADMIN_CONF = """USERNAME = "yubiadmin"
+PASSWORD = "yubiadmin"
+INTERFACE = "127.0.0.1"
+PORT = 8080
+"""
+
+LOGGING_CONF = """[loggers]
+keys=root
+
+[handlers]
+keys=stderr
+
+[formatters]
+keys=
+
+[logger_root]
+level=ERROR
+handlers=stderr
+
+[handler_stderr]
+class=StreamHandler
+args=(sys.stderr,)
+"""
+
+YKVAL_CONFIG = """<?php
+
+# For the verify interface.
+$baseParams = array ();
+$baseParams['__YKVAL_DB_DSN__'] = "mysql:dbname=ykval;host=127.0.0.1";
+$baseParams['__YKVAL_DB_USER__'] = 'ykval_verifier';
+$baseParams['__YKVAL_DB_PW__'] = 'yourpassword';
+$baseParams['__YKVAL_DB_OPTIONS__'] = array();
+
+# For the getapikey interface.
+$baseParams['__YKGAK_ID__'] = 'client_id';
+$baseParams['__YKGAK_KEY__'] = 'key';
+
+$baseParams['__YKVAL_SYNC_POOL__'] = array(
+	"http://api2.example.com/wsapi/2.0/sync",
+	"http://api3.example.com/wsapi/2.0/sync"
+);
+$baseParams['__YKVAL_ALLOWED_SYNC_POOL__'] = array("10.0.0.2", "10.0.0.3");
+
+# Specify how often the sync daemon awakens
+$baseParams['__YKVAL_SYNC_INTERVAL__'] = 10;
+$baseParams['__YKVAL_SYNC_RESYNC_TIMEOUT__'] = 30;
+$baseParams['__YKVAL_SYNC_OLD_LIMIT__'] = 10;
+
+$baseParams['__YKVAL_SYNC_FAST_LEVEL__'] = 1;
+$baseParams['__YKVAL_SYNC_SECURE_LEVEL__'] = 40;
+$baseParams['__YKVAL_SYNC_DEFAULT_LEVEL__'] = 60;
+$baseParams['__YKVAL_SYNC_DEFAULT_TIMEOUT__'] = 1;
+
+function otp2ksmurls ($otp, $client) {
+  return array(
+	       "http://localhost/wsapi/decrypt?otp=$otp",
+	       );
+}
+
+?>
+"""
+
+CONFIG_DB = """<?php
+$dbuser='%s';
+$dbpass='secret';
+$basepath='';
+$dbname='%s';
+$dbserver='';
+$dbport='';
+$dbtype='mysql';
+?>
+"""
+
+KSM_CONFIG = """<?php
+$db_dsn = "mysql:dbname=ykksm;host=127.0.0.1";
+$db_username = "ykksmreader";
+$db_password = "secret";
+?>
+"""
+
+YUBIAUTH_CONF = """YKVAL_SERVERS = ['https://api.yubico.com/wsapi/2.0/verify']
+YKVAL_CLIENT_ID = 12345
+YKVAL_CLIENT_SECRET = 'c2VjcmV0c2VjcmV0c2VjcmV0'
+AUTO_PROVISION = True
+SECURITY_LEVEL = 1
+USE_LDAP = False
+"""
+
+RADIUS_CLIENT = """
+# NAS %(i)d
+client nas-%(i)d {
+\tipaddr = 10.%(r)d.%(n)d.1
+\tsecret = s3cret-%(i)d
+\tshortname = nas-%(i)d
+\tnastype = other
+}
+"""
+
+STUBS = {
+    'ykval-export-clients': """#!/bin/sh
+i=1
+while [ $i -le %d ]; do
+    echo "$i,1,1400000000,a2V5LSRpLWtleS1rZXkta2V5LWtleQ==,,,"
+    i=$((i+1))
+done
+""" % CLIENTS,
+    'ykval-gen-clients': """#!/bin/sh
+echo "%d,a2V5LWtleS1rZXkta2V5LWtleS1rZXk="
+""" % (CLIENTS + 1),
+    'apt-get': """#!/bin/sh
+case "$*" in
+    *-s*) echo "Inst libc6 [2.13-38] (2.13-38+deb7u1 Debian-Security)";;
+esac
+""",
+    'invoke-rc.d': """#!/bin/sh
+[ "$2" = status ] && exit 3
+exit 0
+""",
+    'radtest': """#!/bin/sh
+echo "Sending Access-Request"
+exit 1
+"""
+}
+
+
+def write(root, path, content, mode=None):
+    filename = os.path.join(root, path.lstrip('/'))
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename, 'w') as f:
+        f.write(content)
+    if mode is not None:
+        os.chmod(filename, mode)
+    return filename
+
+
+def build_fixtures(root):
+    """
+    Writes the config files of all apps under root, as they would be found
+    under /, and stub commands in root/bin.
+    """
+    write(root, '/etc/yubico/admin/yubiadmin.conf', YUBIADMIN_CONF)
+    write(root, '/etc/yubico/admin/logging.conf', LOGGING_CONF)
+    write(root, '/etc/yubico/val/ykval-config.php', YKVAL_CONFIG)
+    write(root, '/etc/yubico/val/config-db.php',
+          CONFIG_DB % ('ykval_verifier', 'ykval'))
+    write(root, '/etc/yubico/ksm/ykksm-config.php', KSM_CONFIG)
+    write(root, '/etc/yubico/ksm/config-db.php',
+          CONFIG_DB % ('ykksmreader', 'ykksm'))
+    write(root, '/etc/yubico/auth/yubiauth.conf', YUBIAUTH_CONF)
+    write(root, '/etc/freeradius/clients.conf', ''.join(
+        RADIUS_CLIENT % {'i': i, 'r': i // 250, 'n': i % 250}
+        for i in range(RADIUS_CLIENTS)))
+    os.makedirs(os.path.join(root, 'var/tmp'))
+    for name, content in STUBS.items():
+        write(root, '/bin/%s' % name, content, 0o755)
+
+
+def relocate(root):
+    """
+    Makes the apps use the fixtures under root, by prefixing the paths they
+    refer to, and returns the application.
+    """
+    def moved(path):
+        if path.startswith(('/etc/', '/var/')):
+            return os.path.join(root, path.lstrip('/'))
+        return path
+
+    # Before the apps are imported, as they take their paths from here.
+    from yubiadmin import paths
+    for name in paths.__all__:
+        setattr(paths, name, moved(getattr(paths, name)))
+
+    from yubiadmin.apps import apps, registry
+    from yubiadmin.util.config import FileConfig
+
+    for info in apps:
+        module = sys.modules[type(info.load()).__module__]
+        for name, value in vars(module).items():
+            if isinstance(value, str):
+                setattr(module, name, moved(value))
+            elif isinstance(value, FileConfig):
+                value.filename = moved(value.filename)
+    registry.invalidate()
+
+    from yubiadmin.server import application
+    return application
+
+
+def form_data(forms):
+    """
+    Returns the current values of forms, as they would be posted back.
+    """
+    data = {}
+    for form in forms:
+        form.load()
+        for field in form:
+            if field.type == 'BooleanField':
+                if field.data:
+                    data[field.name] = 'y'
+            elif field.type == 'SelectField':
+                data[field.name] = str(field.data)
+            elif field.type != 'PasswordField':
+                data[field.name] = field._value()
+    return data
+
+
+def scenarios(root):
+    """
+    Returns (name, path, POST data or None) for everything to measure.
+    """
+    from yubiadmin.apps import registry
+    from yubiadmin.apps import admin, val, auth
+
+    result = [('dashboard', '/', None)]
+    for info in registry:
+        if info.disabled or info.hidden:
+            continue
+        for section in info.app.sections:
+            path = '/%s/%s' % (info.name, section)
+            result.append((path, path, None))
+
+    result.extend([
+        ('list /val/clients/', '/val/clients/', None),
+        ('list /val/clients/1001-1010', '/val/clients/1001-1010', None),
+        ('search /val/clients/?q=1234', '/val/clients/?q=1234', None),
+    ])
+
+    with open(os.path.join(root, 'etc/freeradius/clients.conf')) as f:
+        clients_conf = f.read()
+    result.extend([
+        ('POST /admin/general', '/admin/general',
+         form_data([admin.ConnectionForm(), admin.CredentialsForm()])),
+        ('POST /val/synchronization', '/val/synchronization',
+         form_data([val.DaemonForm(), val.SyncPoolForm()])),
+        ('POST /val/ksms', '/val/ksms', form_data([val.KSMForm()])),
+        ('POST /auth/general', '/auth/general',
+         form_data([auth.SecurityForm()])),
+        ('POST /freerad/clients', '/freerad/clients',
+         {'content': clients_conf}),
+    ])
+    return result
+
+
+def percentile(times, fraction):
+    return times[min(len(times) - 1, int(len(times) * fraction))]
+
+
+def measure(application, path, data, count):
+    from webob import Request
+
+    def request():
+        if data is None:
+            req = Request.blank(path)
+        else:
+            req = Request.blank(path, POST=data)
+        return req.get_response(application).status_int
+
+    statuses = set(request() for i in range(3))
+    times = []
+    for i in range(count):
+        start = time.time()
+        statuses.add(request())
+        times.append(time.time() - start)
+    total = sum(times)
+    times.sort()
+    return {
+        'requests': count,
+        'rps': count / total if total else 0,
+        'p50_ms': percentile(times, 0.5) * 1000,
+        'p99_ms': percentile(times, 0.99) * 1000,
+        'status': sorted(statuses)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', '--requests', type=int, default=100,
+                        help='Requests per scenario')
+    parser.add_argument('-o', '--output', default='bench_wsgi.json',
+                        help='File to write the results to')
+    parser.add_argument('-k', '--keep', action='store_true',
+                        help='Keep the fixture directory')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='yubiadmin-bench-')
+    try:
+        build_fixtures(root)
+        # Must be set before yubiadmin reads its settings.
+        os.environ['YUBIADMIN_SETTINGS'] = os.path.join(
+            root, 'etc/yubico/admin/yubiadmin.conf')
+        os.environ['PATH'] = os.pathsep.join([os.path.join(root, 'bin'),
+                                              os.environ.get('PATH', '')])
+        application = relocate(root)
+
+        results = []
+        print('%-36s %10s %10s %10s' % ('', 'req/s', 'p50', 'p99'))
+        for name, path, data in scenarios(root):
+            result = measure(application, path, data, args.requests)
+            result['name'] = name
+            results.append(result)
+            print('%-36s %10.1f %8.2fms %8.2fms%s' % (
+                name, result['rps'], result['p50_ms'], result['p99_ms'],
+                '' if max(result['status']) < 400
+                else '  status %s' % result['status']))
+    finally:
+        if args.keep:
+            print('Fixtures kept in %s' % root)
+        else:
+            shutil.rmtree(root)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': results
+        }, f, indent=2, sort_keys=True)
+    print('Results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -26,21 +26,135 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import os
-import sys
+import ast
+import time
+import logging
+import threading
 from importlib import import_module
+from yubiadmin import paths
+from yubiadmin.config import settings
+from yubiadmin.util.registry import AppRegistry, parse_doc
+from yubiadmin.util.watch import watcher
 
-apps = []
-__all__ = ['apps']
+__all__ = [
+    'apps',
+    'registry',
+    'LazyApp',
+    'describe'
+]
 
+log = logging.getLogger(__name__)
 
-def get_name(app):
-    return getattr(app, 'name', None) or sys.modules[app.__module__].__file__ \
-        .split('/')[-1].rsplit('.', 1)[0]
 
-for filename in os.listdir(os.path.dirname(__file__)):
-    if filename.endswith('.py') and not filename.startswith('__'):
-        module = import_module('yubiadmin.apps.%s' % filename[:-3])
-        __all__.append(module)
-        if hasattr(module, 'app'):
-            apps.append(module.app)
-apps.sort(key=lambda app: (app.priority, app.name))
+class LazyApp(object):
+    """
+    Describes an app without importing its module, which only happens once
+    the app itself is needed. Until then, the app is considered disabled when
+    the path given as requires doesn't exist.
+    """
+    def __init__(self, name, title, description=None, priority=50,
+                 requires=None, hidden=False):
+        self.name = name
+        self.title = title
+        self.description = description or title
+        self.priority = priority
+        self.requires = requires
+        self._hidden = hidden
+        self._app = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._app is not None
+
+    @property
+    def disabled(self):
+        if self._app is not None:
+            return bool(getattr(self._app, 'disabled', False))
+        return self.requires is not None and not os.path.exists(self.requires)
+
+    @property
+    def hidden(self):
+        if self._app is not None:
+            return bool(getattr(self._app, 'hidden', False))
+        return self._hidden
+
+    def load(self):
+        if self._app is None:
+            with self._lock:
+                if self._app is None:
+                    start = time.time()
+                    module = import_module('yubiadmin.apps.%s' % self.name)
+                    self._app = module.app
+                    log.info('Loaded app %s in %.1fms', self.name,
+                             (time.time() - start) * 1000)
+        return self._app
+
+
+def _literal(node):
+    # Literals, or names of paths declared in yubiadmin.paths.
+    if isinstance(node, ast.Name) and node.id in paths.__all__:
+        return getattr(paths, node.id)
+    return ast.literal_eval(node)
+
+
+def describe(filename):
+    """
+    Reads the app defined by a module from its source, without importing it.
+    Title and description come from the docstring of the app class, priority
+    and hidden from its class attributes, and requires from the module level
+    __requires__ declaration. Returns None if the module defines no app.
+    """
+    with open(filename) as f:
+        tree = ast.parse(f.read(), filename)
+    classes = {}
+    app_class = None
+    info = {}
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef):
+            classes[node.name] = node
+        elif isinstance(node, ast.Assign) and len(node.targets) == 1 \
+                and isinstance(node.targets[0], ast.Name):
+            target = node.targets[0].id
+            if target == 'app' and isinstance(node.value, ast.Call) \
+                    and isinstance(node.value.func, ast.Name):
+                app_class = node.value.func.id
+            elif target == '__requires__':
+                info['requires'] = _literal(node.value)
+    if app_class not in classes:
+        return None
+    cls = classes[app_class]
+    for node in cls.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 \
+                and isinstance(node.targets[0], ast.Name) \
+                and node.targets[0].id in ('priority', 'hidden'):
+            info[node.targets[0].id] = _literal(node.value)
+    info['title'], info['description'] = parse_doc(ast.get_docstring(cls),
+                                                   app_class)
+    return info
+
+
+def _discover():
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    found = []
+    for filename in sorted(os.listdir(dirname)):
+        if filename.endswith('.py') and not filename.startswith('__'):
+            info = describe(os.path.join(dirname, filename))
+            if info is not None:
+                found.append(LazyApp(filename[:-3], **info))
+    return found
+
+apps = _discover()
+registry = AppRegistry(apps, settings['app_state_interval'])
+
+_required = set(app.requires for app in apps if app.requires)
+
+
+def _requirement_changed(path):
+    # An app being installed or removed changes which apps are disabled.
+    if path in _required:
+        registry.invalidate()
+
+for filename in _required:
+    watcher.watch(filename)
+watcher.subscribe(_requirement_changed)
@@ -25,27 +25,49 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-from threading import Timer
+from threading import Lock
 from wtforms.fields import IntegerField, TextField, PasswordField
-from wtforms.widgets import PasswordInput
 from wtforms.validators import NumberRange, IPAddress
 from yubiadmin.util.app import App
+from yubiadmin.util.basicauth import hash_password, is_password_hash
 from yubiadmin.util.config import python_handler, FileConfig
 from yubiadmin.util.form import ConfigForm
-from yubiadmin.util.system import invoke_rc_d
+from yubiadmin.util.jobs import jobs, run_service
 
 __all__ = [
     'app'
 ]
 
 
+def password_handler(varname, default):
+    """
+    Like python_handler, but stores the password hashed.
+    """
+    handler = python_handler(varname, default)
+    writer = handler.writer
+    # Defaults are written on every read of a config lacking them, so reuse
+    # the hash rather than computing a new one each time.
+    last = [(None, None)]
+    lock = Lock()
+
+    def write(value):
+        if not is_password_hash(value):
+            with lock:
+                if value != last[0][0]:
+                    last[0] = (value, hash_password(value))
+                value = last[0][1]
+        return writer(value)
+    handler.writer = write
+    return handler
+
+
 admin_config = FileConfig(
     '/etc/yubico/admin/yubiadmin.conf',
     [
         ('interface', python_handler('INTERFACE', '127.0.0.1')),
         ('port', python_handler('PORT', 8080)),
         ('username', python_handler('USERNAME', 'yubiadmin')),
-        ('password', python_handler('PASSWORD', 'yubiadmin')),
+        ('password', password_handler('PASSWORD', 'yubiadmin')),
     ]
 )
 
@@ -66,7 +88,14 @@ class CredentialsForm(ConfigForm):
 
     username = TextField('Username', [])
     password = PasswordField('Password',
-                             widget=PasswordInput(hide_value=False))
+                             description='Leave blank to keep the current '
+                             'password')
+
+    def save(self):
+        if not self.password.data:
+            self.config.read()
+            self.password.data = self.config['password']
+        super(CredentialsForm, self).save()
 
 
 class YubiAdmin(App):
@@ -86,11 +115,10 @@ class YubiAdmin(App):
                                  template='admin/general')
 
     def restart(self, request):
-        if 'now' in request.params:
-            invoke_rc_d('yubiadmin', 'restart')
-        else:
-            timer = Timer(1, invoke_rc_d, args=('yubiadmin', 'restart'))
-            timer.start()
+        # Give the response a chance to reach the browser.
+        jobs.submit('Restarting YubiAdmin', run_service,
+                    ('yubiadmin', 'restart'), key='yubiadmin',
+                    delay=0 if 'now' in request.params else 1)
         return self.redirect('/%s/general' % self.name)
 
 
@@ -41,12 +41,15 @@ from yubiadmin.util.config import (python_handler, python_list_handler,
                                    FileConfig)
 from yubiadmin.util.form import ConfigForm, FileForm, ListField
 from yubiadmin.apps.dashboard import panel
+from yubiadmin.paths import AUTH_CONFIG_FILE
 import logging
 
 __all__ = [
     'app'
 ]
 
+__requires__ = AUTH_CONFIG_FILE
+
 log = logging.getLogger(__name__)
 
 try:
@@ -56,7 +59,6 @@ except ImportError:
     YUBIAUTH_INSTALLED = False
 YubiAuth = None
 
-AUTH_CONFIG_FILE = '/etc/yubico/auth/yubiauth.conf'
 YKVAL_SERVERS = [
     'https://api.yubico.com/wsapi/2.0/verify',
     'https://api2.yubico.com/wsapi/2.0/verify',
@@ -25,13 +25,25 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import os
+import time
+import logging
+from Queue import Queue
+from threading import Thread, Event, Lock
 from yubiadmin.util.app import App, render
+from yubiadmin.util.probe import probes
+from yubiadmin.config import settings
 
 __all__ = [
     'app',
     'panel'
 ]
 
+log = logging.getLogger(__name__)
+
+# Panels of different apps are collected at once, up to this many.
+PANEL_WORKERS = 4
+
 
 def panel(title, content, link=None, level=None):
     return {
@@ -42,13 +54,117 @@ def panel(title, content, link=None, level=None):
     }
 
 
+def app_title(app):
+    return (app.__doc__ or app.name).strip().split('\n', 1)[0]
+
+
+class PanelTask(object):
+    """
+    Collects the dashboard panels of a single app, in a worker of the pool.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.panels = None
+        self.done = Event()
+
+    def run(self):
+        try:
+            self.panels = list(self.app.dash_panels)
+        except Exception as e:
+            log.exception('Failed to collect dashboard panels for %s',
+                          self.app.name)
+            self.panels = [panel(app_title(self.app),
+                                 'Unable to get status: %s' % e,
+                                 level='danger')]
+        finally:
+            self.done.set()
+
+
+class PanelPool(object):
+    """
+    A fixed number of worker threads collecting panels, shared by all
+    requests.
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self._queue = Queue()
+        self._pid = None
+        self._lock = Lock()
+
+    def submit(self, task):
+        self._start()
+        self._queue.put(task)
+
+    def _start(self):
+        # Threads don't survive fork(), so each process starts its own.
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i in range(self.workers):
+                thread = Thread(target=self._run, name='dashboard-%d' % i)
+                thread.daemon = True
+                thread.start()
+
+    def _run(self):
+        while True:
+            self._queue.get().run()
+
+
 class DashboardApp(App):
     hidden = True
 
+    def __init__(self):
+        self._pool = PanelPool(PANEL_WORKERS)
+        self._tasks = {}
+        self._last_panels = {}
+        self._lock = Lock()
+
+    def _task(self, app):
+        # Reuse a task which is still pending since the last request, so
+        # that a hanging provider doesn't get more than one worker.
+        with self._lock:
+            task = self._tasks.get(app.name)
+            if task is not None and task.done.is_set():
+                # Finished after the request which started it timed out.
+                self._last_panels[app.name] = task.panels
+                task = None
+            if task is None:
+                task = self._tasks[app.name] = PanelTask(app)
+                self._pool.submit(task)
+            return task
+
+    def _timed_out(self, app):
+        with self._lock:
+            last = self._last_panels.get(app.name)
+        if last is None:
+            return [panel(app_title(app), 'Timed out while getting status.')]
+        return [dict(p, content='%s<br /><em>(Timed out, last known status)'
+                     '</em>' % p['content']) for p in last]
+
+    def collect_panels(self, apps, timeout):
+        tasks = [self._task(app) for app in apps]
+        deadline = time.time() + timeout
+        panels = []
+        for task in tasks:
+            if not task.done.wait(max(0, deadline - time.time())):
+                log.warning('Dashboard panels for %s timed out',
+                            task.app.name)
+                panels.extend(self._timed_out(task.app))
+            else:
+                with self._lock:
+                    self._last_panels[task.app.name] = task.panels
+                panels.extend(task.panels)
+        return panels
+
     def __call__(self, request):
-        from yubiadmin.apps import apps
-        panels = [panel for app in apps if not getattr(app, 'disabled', False)
-                  and hasattr(app, 'dash_panels') for panel in app.dash_panels]
+        from yubiadmin.apps import registry
+        if 'refresh' in request.params:
+            probes.invalidate()
+            registry.invalidate()
+        panels = self.collect_panels(
+            [app for app in registry.enabled() if hasattr(app, 'dash_panels')],
+            settings['dashboard_timeout'])
         request.environ['yubiadmin.response'].extend('content',
                                                      render('dashboard',
                                                             panels=panels))
@@ -26,10 +26,13 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 from yubiadmin.util.app import App, CollectionApp, render
-from yubiadmin.util.system import run, invoke_rc_d
+from yubiadmin.util.system import MAX_OUTPUT, call, pid_running
+from yubiadmin.util.jobs import jobs, run_service
 from yubiadmin.util.form import FileForm
-from yubiadmin.util.config import parse_block
+from yubiadmin.util.config import file_cache, write_file
+from yubiadmin.util.probe import probe
 from yubiadmin.apps.dashboard import panel
+from yubiadmin.paths import FREERADIUS_CONFIG_DIR
 from wtforms import Form
 from wtforms.fields import TextField
 import os
@@ -39,12 +42,28 @@ __all__ = [
     'app'
 ]
 
+__requires__ = FREERADIUS_CONFIG_DIR
+
 CLIENTS_CONFIG_FILE = '/etc/freeradius/clients.conf'
+PID_FILE = '/var/run/freeradius/freeradius.pid'
 
 
+@probe('freerad.running', ttl=10)
 def is_freerad_running():
-    status, _ = run('cat /var/run/freeradius/freeradius.pid | xargs kill -0')
-    return status == 0
+    return pid_running(PID_FILE)
+
+
+def control_server(job, cmd):
+    """
+    Job function starting, stopping or restarting FreeRADIUS. toggle starts
+    or stops it depending on whether it is running.
+    """
+    try:
+        if cmd == 'toggle':
+            cmd = 'stop' if is_freerad_running.refresh() else 'start'
+        run_service(job, 'freeradius', cmd)
+    finally:
+        is_freerad_running.invalidate()
 
 
 class RadTestForm(Form):
@@ -73,7 +92,7 @@ class FreeRadius(App):
 
     @property
     def disabled(self):
-        return not os.path.isdir('/etc/freeradius')
+        return not os.path.isdir(FREERADIUS_CONFIG_DIR)
 
     @property
     def dash_panels(self):
@@ -97,8 +116,10 @@ class FreeRadius(App):
             password = form.password.data
             secret = form.client_secret.data
 
-            cmd = 'radtest "%s" "%s" localhost 0 "%s"' % (username, password, secret)
-            status, output = run(cmd)
+            args = ['radtest', username, password, 'localhost', '0', secret]
+            cmd = 'radtest "%s" "%s" localhost 0 "%s"' % (username, password,
+                                                        secret)
+            status, output = call(args, limit=MAX_OUTPUT)
             alert = {'title': 'Command: %s' % cmd}
             alert['message'] = '<pre style="white-space: pre-wrap;">%s</pre>' \
                 % output
@@ -113,7 +134,8 @@ class FreeRadius(App):
             alerts.append(alert)
 
         return render('freerad/general', form=form, alerts=alerts,
-                      running=is_freerad_running())
+                      running=is_freerad_running(),
+                      job=jobs.active('freeradius'), scripts=['job'])
 
     def _unused_clients(self, request):
         """
@@ -122,14 +144,9 @@ class FreeRadius(App):
         return self._clients(request)
 
     def server(self, request):
-        if request.params['server'] == 'toggle':
-            if is_freerad_running():
-                invoke_rc_d('freeradius', 'stop')
-            else:
-                invoke_rc_d('freeradius', 'start')
-        else:
-            invoke_rc_d('freeradius', 'restart')
-
+        cmd = 'toggle' if request.params['server'] == 'toggle' else 'restart'
+        jobs.submit('FreeRADIUS %s' % cmd, control_server, (cmd,),
+                    key='freeradius')
         return self.redirect('/%s/general' % self.name)
 
     def clients(self, request):
@@ -164,28 +181,55 @@ def parse_client(name, content):
     return client
 
 
+def _block_end(line, depth):
+    """
+    Returns the depth after line, and the position of the brace closing the
+    block if it is on this line.
+    """
+    if '{' not in line and '}' not in line:
+        return depth, None
+    for pos, c in enumerate(line):
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth < 0:
+                return depth, pos
+    return depth, None
+
+
 def parse_clients(content):
+    """
+    Yields each client block, in a single pass over the lines of content.
+    start and end are the line span of the block, including the braces.
+    """
     lines = content.splitlines()
     index = 0
-    skip = 0
-    for line in lines:
-        if skip > 0:
-            skip -= 1
+    while index < len(lines):
+        match = CLIENT.match(lines[index].strip())
+        if not match:
+            index += 1
             continue
+        start = index
+        depth = 0
+        block = []
+        while index + 1 < len(lines):
+            index += 1
+            depth, pos = _block_end(lines[index], depth)
+            if pos is not None:
+                block.append(lines[index][:pos])
+                break
+            block.append(lines[index])
+        client = parse_client(match.group(1), '\n'.join(block))
+        client['id'] = client['start'] = start
+        client['end'] = index + 1
+        client['label'] = client['Name']
+        index += 1
+        yield client
 
-        match = CLIENT.match(line.strip())
-        if match:
-            name = match.group(1)
-            c_content = parse_block('\n'.join(lines[index + 1:]), '{', '}')
-            client = parse_client(name, c_content)
-            skip = len(c_content.splitlines())
-            client['id'] = index
-            client['start'] = index
-            client['end'] = index + skip + 2
-            index += skip
-            yield client
 
-        index += 1
+def index_clients(content):
+    return list(parse_clients(content))
 
 
 class RadiusClients(CollectionApp):
@@ -195,24 +239,36 @@ class RadiusClients(CollectionApp):
     columns = ['Name', 'Attributes']
     template = 'freerad/client_list'
 
-    def _get(self, offset=0, limit=None):
-        with open(CLIENTS_CONFIG_FILE, 'r') as f:
-            self.content = f.read()
+    def _index(self):
+        """
+        Returns the file entry and its client index, which is only rebuilt
+        once clients.conf has changed.
+        """
+        entry = file_cache.get(CLIENTS_CONFIG_FILE)
+        return entry, entry.memo(index_clients)
+
+    def _size(self):
+        return len(self._index()[1])
 
-        clients = list(parse_clients(self.content))
+    def _get(self, offset=0, limit=None):
+        clients = self._index()[1]
         if limit:
             limit += offset
         return clients[offset:limit]
 
+    def _labels(self, ids):
+        ids = map(int, ids)
+        return [x['label'] for x in self._index()[1] if x['id'] in ids]
+
     def _delete(self, ids):
         ids = map(int, ids)
-        clients = filter(lambda x: x['id'] in ids, self._get())
-        lines = self.content.splitlines()
+        entry, clients = self._index()
+        lines = entry.content.splitlines()
 
         for client in reversed(clients):
-            del lines[client['start']:client['end']]
+            if client['id'] in ids:
+                del lines[client['start']:client['end']]
 
-        with open(CLIENTS_CONFIG_FILE, 'w') as f:
-            f.write(os.linesep.join(lines))
+        write_file(CLIENTS_CONFIG_FILE, '\n'.join(lines))
 
 app = FreeRadius()
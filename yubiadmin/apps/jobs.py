@@ -0,0 +1,75 @@
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import time
+import json
+from webob import Response, exc
+from yubiadmin.util.app import App, render
+from yubiadmin.util.jobs import jobs
+
+__all__ = [
+    'app'
+]
+
+
+class JobsApp(App):
+    """
+    Jobs
+
+    Background jobs
+    """
+    hidden = True
+    sections = ['list']
+
+    def _job(self, request):
+        job = jobs.get(request.params.get('id'))
+        if job is None:
+            raise exc.HTTPNotFound
+        return job
+
+    def list(self, request):
+        """
+        Recent jobs
+        """
+        return render('/jobs/list', jobs=list(jobs), now=time.time())
+
+    def status(self, request):
+        data = self._job(request).as_dict()
+        data['output'] = data['output'].decode('utf-8', 'replace')
+        response = Response(json.dumps(data),
+                            content_type='application/json')
+        response.cache_control = 'no-cache'
+        return response
+
+    def cancel(self, request):
+        if request.method != 'POST':
+            raise exc.HTTPMethodNotAllowed
+        jobs.cancel(self._job(request).id)
+        return self.redirect('/%s/list' % self.name)
+
+
+app = JobsApp()
@@ -28,11 +28,14 @@
 import os
 from yubiadmin.util.app import App
 from yubiadmin.util.form import DBConfigForm
+from yubiadmin.paths import KSM_CONFIG_FILE, KSM_DB_CONFIG_FILE
 
 __all__ = [
     'app'
 ]
 
+__requires__ = KSM_CONFIG_FILE
+
 
 class YubikeyKsm(App):
     """
@@ -44,13 +47,13 @@ class YubikeyKsm(App):
 
     @property
     def disabled(self):
-        return not os.path.isfile('/etc/yubico/ksm/ykksm-config.php')
+        return not os.path.isfile(KSM_CONFIG_FILE)
 
     def database(self, request):
         """
         Database Settings
         """
-        dbform = DBConfigForm('/etc/yubico/ksm/config-db.php',
+        dbform = DBConfigForm(KSM_DB_CONFIG_FILE,
                               dbname='ykksm', dbuser='ykksmreader')
         return self.render_forms(request, [dbform])
 
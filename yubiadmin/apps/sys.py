@@ -26,11 +26,16 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import os
+import time
+import json
+import logging
 import subprocess
-from webob import Response
-from threading import Timer
+from webob import Response, exc
+from threading import Thread, Lock
 from yubiadmin.util.app import App, render
-from yubiadmin.util.system import run
+from yubiadmin.util.system import call, pid_running
+from yubiadmin.util.jobs import jobs, JobError
+from yubiadmin.util.probe import probe
 from yubiadmin.apps.dashboard import panel
 
 __all__ = [
@@ -38,54 +43,165 @@ __all__ = [
 ]
 
 
+log = logging.getLogger(__name__)
+
 UPGRADE_LOG = "/var/tmp/yubix-upgrade"
+# Cleared on reboot, so that a stale pid can't be mistaken for an upgrade.
+UPGRADE_PID_FILE = "/var/run/yubix-upgrade.pid"
+MAX_READ = 65536
+SSE_DURATION = 30
+SSE_POLL = 0.5
 
 
+@probe('sys.updates', ttl=600)
 def get_updates():
-    s, o = run("apt-get upgrade -s | awk -F'[][() ]+' '/^Inst/{print $2}'")
-    packages = o.splitlines()
-    return packages
+    _, output = call(['apt-get', 'upgrade', '-s'])
+    # Lines look like: Inst package [old version] (new version ...)
+    return [line.split()[1] for line in output.splitlines()
+            if line.startswith('Inst ')]
+
+
+def get_uptime():
+    try:
+        with open('/proc/uptime', 'r') as f:
+            seconds = int(float(f.read().split()[0]))
+    except (IOError, ValueError, IndexError):
+        return 'unknown'
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes = seconds // 60
+    uptime = '%d:%02d' % (hours, minutes) if hours else '%d min' % minutes
+    if days:
+        uptime = '%d day%s, %s' % (days, '' if days == 1 else 's', uptime)
+    return uptime
 
 
 def needs_restart():
     return os.path.isfile('/var/run/reboot-required')
 
 
-def reboot():
-    run('reboot')
-
-
-class Updater(object):
-    def __init__(self):
-        self.proc = subprocess.Popen('DEBIAN_FRONTEND=noninteractive '
-                                     'apt-get -y dist-upgrade -o '
-                                     'Dpkg::Options::="--force-confdef" -o '
-                                     'Dpkg::Options::="--force-confold" | '
-                                     'tee %s' % UPGRADE_LOG,
-                                     stdout=subprocess.PIPE, shell=True)
-
-    def __iter__(self):
-        yield """
-        <script type="text/javascript">
-        function reload() {
-            window.location.replace('/sys');
-        }
-        window.onload = function() {
-            setTimeout(reload, 10000);
-        }
-        </script>
-        <strong>Performing update, this may take a while...</strong><br/>
-        <pre>
+def reboot(job):
+    job.call(['reboot'])
+
+
+def check_updates(job):
+    if upgrade.running:
+        raise JobError('An update is being performed')
+    try:
+        status = job.call(['apt-get', 'update'])
+    finally:
+        get_updates.invalidate()
+    if status != 0:
+        raise JobError('apt-get update failed with status %d' % status)
+
+
+class Upgrade(object):
+    """
+    Runs apt-get dist-upgrade in the background, writing its output to
+    log_file. The pid is kept in pidfile, so that any server process can tell
+    if an upgrade is running, and the upgrade is left running if the server
+    is restarted.
+    """
+    args = ['apt-get', '-y', 'dist-upgrade',
+            '-o', 'Dpkg::Options::=--force-confdef',
+            '-o', 'Dpkg::Options::=--force-confold']
+
+    def __init__(self, log_file, pidfile):
+        self.log_file = log_file
+        self.pidfile = pidfile
+        self.returncode = None
+        self._lock = Lock()
+
+    @property
+    def running(self):
+        return pid_running(self.pidfile)
+
+    def start(self):
         """
+        Starts the upgrade, unless one is already running. Returns True if a
+        new upgrade was started.
+        """
+        with self._lock:
+            if self.running:
+                return False
+            env = dict(os.environ, DEBIAN_FRONTEND='noninteractive')
+            with open(self.log_file, 'w') as log_f:
+                proc = subprocess.Popen(self.args, stdout=log_f,
+                                        stderr=subprocess.STDOUT,
+                                        close_fds=True, env=env,
+                                        preexec_fn=os.setsid)
+            with open(self.pidfile, 'w') as f:
+                f.write('%d\n' % proc.pid)
+            self.returncode = None
+            thread = Thread(target=self._wait, args=(proc,))
+            thread.daemon = True
+            thread.start()
+            log.info('Started upgrade, pid %d', proc.pid)
+            return True
+
+    def _wait(self, proc):
+        self.returncode = proc.wait()
+        log.info('Upgrade finished with status %d', self.returncode)
+        try:
+            os.remove(self.pidfile)
+        except OSError:
+            pass
+        get_updates.invalidate()
 
-        while True:
-            line = self.proc.stdout.readline()
-            if line:
-                yield line
-            else:
-                yield '</pre><br /><strong>Update complete!</strong>'
-                yield '<script type="text/javascript">reload();</script>'
-                break
+    def read(self, offset=0, limit=MAX_READ):
+        """
+        Returns up to limit bytes of the log starting at offset, and the
+        offset to continue from. Reading starts over if the log has been
+        replaced by a newer upgrade.
+        """
+        try:
+            with open(self.log_file, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                if offset > f.tell():
+                    offset = 0
+                f.seek(offset)
+                data = f.read(limit)
+        except IOError:
+            return '', 0
+        return data, offset + len(data)
+
+
+upgrade = Upgrade(UPGRADE_LOG, UPGRADE_PID_FILE)
+
+
+def parse_offset(value):
+    try:
+        offset = int(value)
+    except (TypeError, ValueError):
+        offset = -1
+    if offset < 0:
+        raise exc.HTTPBadRequest('Invalid offset: %s' % value)
+    return offset
+
+
+def event_stream(offset, duration=SSE_DURATION):
+    """
+    Yields new upgrade output as Server-Sent Events, with the offset following
+    each chunk as its id, so that a reconnecting client resumes where it left
+    off. Ends once the upgrade is done, or after duration seconds after which
+    the client reconnects, so as not to occupy a server thread indefinitely.
+    """
+    yield 'retry: 1000\n\n'
+    end = time.time() + duration
+    while True:
+        running = upgrade.running
+        data, offset = upgrade.read(offset)
+        if data:
+            lines = data.decode('utf-8', 'replace').splitlines()
+            yield 'id: %d\n%s\n' % (offset, ''.join(
+                'data: %s\n' % line for line in lines).encode('utf-8'))
+        elif not running:
+            yield 'event: done\ndata: %s\n\n' % upgrade.returncode
+            break
+        elif time.time() > end:
+            break
+        else:
+            time.sleep(SSE_POLL)
 
 
 class SystemApp(App):
@@ -118,39 +234,73 @@ class SystemApp(App):
                 'info'
             )
 
-        _, time = run('date "+%a, %d %b %Y %H:%M"')
-        _, result = run('uptime')
-        rest = [x.strip() for x in result.split('up', 1)][1]
-        parts = [x.strip() for x in rest.split(',')]
-        uptime = parts[0] if not 'days' in parts[0] else '%s, %s' % \
-            tuple(parts[:2])
+        date = time.strftime('%a, %d %b %Y %H:%M')
         yield panel('System', 'Date: %s<br />Uptime: %s' %
-                   (time, uptime), level='info')
+                   (date, get_uptime()), level='info')
 
     def general(self, request):
         alerts = []
         if needs_restart():
             alerts.append({'message': 'The machine needs to reboot.',
                            'type': 'error'})
-        return render('/sys/general', alerts=alerts, updates=get_updates())
+        if 'refresh' in request.params:
+            get_updates.invalidate()
+        return render('/sys/general', alerts=alerts, updates=get_updates(),
+                      updates_age=get_updates.age, upgrading=upgrade.running,
+                      job=jobs.active('apt'), scripts=['job'])
 
     def update(self, request):
-        run('apt-get update')
+        jobs.submit('Checking for updates', check_updates, key='apt')
         return self.redirect('/sys')
 
     def dist_upgrade(self, request):
+        """
+        Shows the progress of a running upgrade. A new upgrade is only
+        started on POST, and not while apt is busy checking for updates.
+        """
+        if upgrade.running:
+            return render('/sys/upgrade', scripts=['upgrade'])
+        if request.method != 'POST':
+            return self.redirect('/%s/general' % self.name)
+        if jobs.active('apt'):
+            alerts = [{'message': 'Still checking for updates, please try '
+                       'again once done.', 'type': 'error'}]
+            return render('/sys/general', alerts=alerts)
         if get_updates():
-            return Response(app_iter=Updater())
+            upgrade.start()
+            return render('/sys/upgrade', scripts=['upgrade'])
         else:
             alerts = [{'message': 'Software is up to date!'}]
             return render('/sys/general', alerts=alerts)
 
+    def upgrade_log(self, request):
+        """
+        Returns upgrade output from the byte offset given by the offset
+        parameter, or as Server-Sent Events if requested.
+        """
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            offset = request.headers.get('Last-Event-ID',
+                                         request.params.get('offset', 0))
+            response = Response(app_iter=event_stream(parse_offset(offset)),
+                                content_type='text/event-stream')
+            response.cache_control = 'no-cache'
+            return response
+        running = upgrade.running
+        offset = parse_offset(request.params.get('offset', 0))
+        data, offset = upgrade.read(offset)
+        response = Response(json.dumps({
+            'data': data.decode('utf-8', 'replace'),
+            'offset': offset,
+            'done': not running and not data,
+            'status': upgrade.returncode
+        }), content_type='application/json')
+        response.cache_control = 'no-cache'
+        return response
+
     def reboot(self, request):
-        if 'now' in request.params:
-            run('reboot')
-        else:
-            timer = Timer(1, run, args=('reboot',))
-            timer.start()
+        # Give the response a chance to reach the browser.
+        jobs.submit('Rebooting', reboot, key='reboot',
+                    delay=0 if 'now' in request.params else 1)
         alerts = [{'type': 'warn', 'message': 'Rebooting System...'}]
         return render('/sys/general', alerts=alerts)
 
@@ -27,39 +27,54 @@
 
 import re
 import os
+import time
+import logging
+from base64 import b64encode
+from threading import Lock
+from webob import Response
+from wtforms import Form
 from wtforms.fields import IntegerField
 from wtforms.validators import NumberRange, IPAddress, URL
 from yubiadmin.util.app import App, CollectionApp, render
-from yubiadmin.util.config import (RegexHandler, FileConfig, php_inserter,
-                                   parse_block, strip_comments, strip_quotes)
+from yubiadmin.util.config import (PHPHandler, FileConfig, php_inserter,
+                                   parse_block, strip_comments, strip_quotes,
+                                   after_commit)
 from yubiadmin.util.form import ConfigForm, FileForm, DBConfigForm, ListField
-from yubiadmin.util.system import invoke_rc_d, run
+from yubiadmin.util.system import invoke_rc_d, call, stream
+from yubiadmin.util.jobs import jobs, run_service
+from yubiadmin.util.db import Database, IntegrityError
+from yubiadmin.util.probe import probe
+from yubiadmin.config import settings
+from yubiadmin.paths import YKVAL_CONFIG_FILE, YKVAL_DB_CONFIG_FILE
 from yubiadmin.apps.dashboard import panel
 
 __all__ = [
     'app'
 ]
 
+__requires__ = YKVAL_CONFIG_FILE
 
-YKVAL_CONFIG_FILE = '/etc/yubico/val/ykval-config.php'
+log = logging.getLogger(__name__)
 
 
-def yk_pattern(varname, prefix='', suffix='', flags=None):
-    regex = r'(?m)^(?!#)\$baseParams\[\'__YKVAL_%s__\'\]\s*=' \
-            '\s*%s(.*?)%s\s*;\s*$' % (varname, prefix, suffix)
-    if flags:
-        regex = '(?%s)' % flags + regex
-    return regex
+MAX_BULK_CLIENTS = 10000
+
+
+ARRAY_VALUE = re.compile(r'(?s)^array\s*\((.*)\)$')
+
+
+def yk_key(varname):
+    return '__YKVAL_%s__' % varname
 
 
 def yk_write(varname, prefix='', suffix=''):
-    return lambda x: '$baseParams[\'__YKVAL_%s__\'] = %s%s%s;' % \
-        (varname, prefix, x, suffix)
+    return lambda x: '$baseParams[\'%s\'] = %s%s%s;' % \
+        (yk_key(varname), prefix, x, suffix)
 
 
 def yk_handler(varname, default):
-    return RegexHandler(yk_pattern(varname), yk_write(varname),
-                        inserter=php_inserter, default=default)
+    return PHPHandler('baseParams', yk_write(varname), key=yk_key(varname),
+                      default=default)
 
 
 def yk_parse_arraystring(value):
@@ -67,12 +82,16 @@ def yk_parse_arraystring(value):
                          .split(',')])
 
 
+def yk_parse_array(value):
+    match = ARRAY_VALUE.match(value)
+    return yk_parse_arraystring(match.group(1)) if match else []
+
+
 def yk_array_handler(varname):
-    pattern = yk_pattern(varname, 'array\(', '\)', 's')
     str_write = yk_write(varname, 'array(\n', '\n)')
     writer = lambda xs: str_write(',\n'.join(['\t"%s"' % x for x in xs]))
-    reader = lambda match: yk_parse_arraystring(match.group(1))
-    return RegexHandler(pattern, writer, reader, php_inserter, [])
+    return PHPHandler('baseParams', writer, yk_parse_array,
+                      key=yk_key(varname), default=[])
 
 
 QUOTED_STRS = re.compile(r'((?:"[^"]+")|(?:\'[^\']+\'))')
@@ -110,10 +129,28 @@ class KSMHandler(object):
             return php_inserter(content, value)
 
 
+@probe('val.daemon', ttl=10)
 def is_daemon_running():
     return invoke_rc_d('ykval-queue', 'status')[0] == 0
 
 
+def control_daemon(job, cmd):
+    """
+    Job function starting, stopping or restarting the sync daemon. toggle
+    starts or stops it, condrestart restarts it only if it is running.
+    """
+    try:
+        if cmd == 'toggle':
+            cmd = 'stop' if is_daemon_running.refresh() else 'start'
+        elif cmd == 'condrestart':
+            if not is_daemon_running.refresh():
+                return
+            cmd = 'restart'
+        run_service(job, 'ykval-queue', cmd)
+    finally:
+        is_daemon_running.invalidate()
+
+
 ykval_config = FileConfig(
     YKVAL_CONFIG_FILE,
     [
@@ -183,8 +220,11 @@ class SyncPoolForm(ConfigForm):
 
     def save(self):
         super(SyncPoolForm, self).save()
-        if is_daemon_running():
-            invoke_rc_d('ykval-queue', 'restart')
+        after_commit(self.restart_daemon)
+
+    def restart_daemon(self):
+        jobs.submit('Restarting the sync daemon', control_daemon,
+                    ('condrestart',), key='ykval-queue')
 
 
 class KSMForm(ConfigForm):
@@ -244,24 +284,21 @@ class YubikeyVal(App):
         """
         Database Settings
         """
-        dbform = DBConfigForm('/etc/yubico/val/config-db.php',
+        dbform = DBConfigForm(YKVAL_DB_CONFIG_FILE,
                               dbname='ykval', dbuser='ykval_verifier')
         return self.render_forms(request, [dbform])
 
     def synchronization(self, request):
         return self.render_forms(request, [DaemonForm(), SyncPoolForm()],
                                  template='val/synchronization',
-                                 daemon_running=is_daemon_running())
+                                 daemon_running=is_daemon_running(),
+                                 job=jobs.active('ykval-queue'),
+                                 scripts=['job'])
 
     def daemon(self, request):
-        if request.params['daemon'] == 'toggle':
-            if is_daemon_running():
-                invoke_rc_d('ykval-queue', 'stop')
-            else:
-                invoke_rc_d('ykval-queue', 'start')
-        else:
-            invoke_rc_d('ykval-queue', 'restart')
-
+        cmd = 'toggle' if request.params['daemon'] == 'toggle' else 'restart'
+        jobs.submit('Sync daemon %s' % cmd, control_daemon, (cmd,),
+                    key='ykval-queue')
         return self.redirect('/%s/synchronization' % self.name)
 
     def ksms(self, request):
@@ -279,6 +316,200 @@ class YubikeyVal(App):
     advanced.advanced = True
 
 
+def client_matches(line, query):
+    """
+    Checks if the Client ID or API key of an exported client line starts with
+    query.
+    """
+    parts = line.split(',', 4)
+    return parts[0].startswith(query) or \
+        (len(parts) > 3 and parts[3].startswith(query))
+
+
+class ClientList(object):
+    """
+    Snapshot of the output of ykval-export-clients, which is only re-exported
+    once it is older than ttl seconds or has been invalidated. Rows are kept
+    as unparsed lines, and only the ones shown are split into columns.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.loaded = None
+        self._lines = []
+        self._matches = (None, [])
+        self._lock = Lock()
+
+    def invalidate(self):
+        self.loaded = None
+
+    def _lines_for(self, query):
+        with self._lock:
+            if self.loaded is None or time.time() - self.loaded >= self.ttl:
+                status, output = call(['ykval-export-clients'], limit=None)
+                if status == 0:
+                    self._lines = output.splitlines()
+                    self.loaded = time.time()
+                else:
+                    # Not cached, so the next request tries again.
+                    log.error('ykval-export-clients exited with status: %d',
+                              status)
+                    self._lines = []
+                self._matches = (None, [])
+            lines = self._lines
+            if not query:
+                return lines
+            if self._matches[0] != query:
+                self._matches = (query, [line for line in lines
+                                         if client_matches(line, query)])
+            return self._matches[1]
+
+    def size(self, query=None):
+        return len(self._lines_for(query))
+
+    def get(self, offset=0, limit=None, query=None):
+        lines = self._lines_for(query)
+        end = offset + limit if limit else None
+        return [line.split(',') for line in lines[offset:end]]
+
+    def generate(self, count=1):
+        status, output = call(['ykval-gen-clients', '--urandom', str(count)])
+        self.invalidate()
+        if status != 0:
+            raise Exception('Command exited with status: %d' % status)
+        return [[x.strip() for x in line.split(',')]
+                for line in output.splitlines()]
+
+    def generate_iter(self, count):
+        """
+        Creates count clients, yielding each [id, key] as soon as it has been
+        written by ykval-gen-clients.
+        """
+        created = 0
+        try:
+            for line in stream(['ykval-gen-clients', '--urandom', str(count)],
+                               stderr=False, check=True):
+                created += 1
+                yield [x.strip() for x in line.split(',')]
+        finally:
+            self.invalidate()
+        if created != count:
+            raise Exception('Created %d of %d clients' % (created, count))
+
+
+class DBClientList(object):
+    """
+    Reads and creates clients directly in the ykval database, so that pages
+    are fetched using LIMIT/OFFSET rather than by exporting all clients.
+    """
+    columns = 'id, active, created, secret, email, notes, otp'
+    batch_size = 500
+    retries = 3
+
+    def __init__(self, db):
+        self.db = db
+
+    def invalidate(self):
+        pass
+
+    def _where(self, query):
+        if not query:
+            return '', ()
+        # LIKE wildcards in the query are matched literally.
+        pattern = re.sub(r'([!%_])', r'!\1', query) + '%'
+        if query.isdigit():
+            return " WHERE id = %s OR secret LIKE %s ESCAPE '!'", \
+                (int(query), pattern)
+        return " WHERE secret LIKE %s ESCAPE '!'", (pattern,)
+
+    def size(self, query=None):
+        where, params = self._where(query)
+        return self.db.query('SELECT COUNT(*) FROM clients' + where,
+                             params)[0][0]
+
+    def get(self, offset=0, limit=None, query=None):
+        where, params = self._where(query)
+        sql = 'SELECT %s FROM clients%s ORDER BY id' % (self.columns, where)
+        if limit:
+            sql += ' LIMIT %d' % limit
+        if offset:
+            sql += ' OFFSET %d' % offset
+        return [[str(row[0]), '1' if row[1] else '0'] +
+                [unicode(x or '') for x in row[2:]]
+                for row in self.db.query(sql, params)]
+
+    def generate(self, count=1):
+        """
+        Creates count clients in a single transaction, the same way as
+        ykval-gen-clients does.
+        """
+        for attempt in range(self.retries):
+            try:
+                return self._insert(count)
+            except IntegrityError:
+                # ykval-gen-clients doesn't lock the table, so it may have
+                # taken the same ids.
+                log.warning('Client ids were taken, retrying')
+        raise Exception('Unable to allocate client ids')
+
+    def _insert(self, count):
+        created = int(time.time())
+        with self.db.cursor() as cursor:
+            # Keep others from allocating ids until this is committed.
+            dbtype = self.db.dbtype
+            if dbtype == 'pgsql':
+                cursor.execute('LOCK TABLE clients IN SHARE ROW EXCLUSIVE '
+                               'MODE')
+            if dbtype == 'mysql':
+                cursor.execute('SELECT id FROM clients ORDER BY id DESC '
+                               'LIMIT 1 FOR UPDATE')
+            else:
+                cursor.execute('SELECT MAX(id) FROM clients')
+            row = cursor.fetchone()
+            next_id = (row and row[0] or 0) + 1
+            clients = [[str(next_id + i), b64encode(os.urandom(20))]
+                       for i in range(count)]
+            cursor.executemany(
+                'INSERT INTO clients (%s) VALUES '
+                '(%%s, %%s, %%s, %%s, %%s, %%s, %%s)' % self.columns,
+                [(int(id), True, created, secret, '', '', '')
+                 for id, secret in clients])
+        return clients
+
+    def generate_iter(self, count):
+        """
+        Creates count clients, one transaction per batch_size clients,
+        yielding each batch once it has been committed.
+        """
+        while count > 0:
+            for client in self.generate(min(count, self.batch_size)):
+                yield client
+            count -= self.batch_size
+
+
+class BulkCreateForm(Form):
+    legend = 'Generate API Clients'
+    description = """
+    Generates a number of new API clients at once. The Client IDs and API keys
+    are downloaded as a CSV file while they are being created, and are not
+    shown again afterwards.
+    """
+    count = IntegerField('Number of clients',
+                         [NumberRange(1, MAX_BULK_CLIENTS)], default=10)
+
+
+def clients_csv(first, clients):
+    yield 'client_id,api_key\r\n'
+    yield '%s,%s\r\n' % tuple(first[:2])
+    try:
+        for client in clients:
+            yield '%s,%s\r\n' % tuple(client[:2])
+    except Exception as e:
+        # The response has started, so mark the file as incomplete.
+        log.exception('Error generating clients')
+        message = str(e) or 'Not all clients were created.'
+        yield 'ERROR,"%s"\r\n' % message.replace('"', '""')
+
+
 class YubikeyValClients(CollectionApp):
     base_url = '/val/clients'
     item_name = 'Clients'
@@ -286,40 +517,63 @@ class YubikeyValClients(CollectionApp):
     columns = ['Client ID', 'Enabled', 'API Key']
     template = 'val/client_list'
     selectable = False
+    searchable = True
 
-    def _size(self):
-        status, output = run('ykval-export-clients | wc -l')
-        return int(output) if status == 0 else 0
-
-    def _get(self, offset=0, limit=None):
-        cmd = 'ykval-export-clients'
-        if offset > 0:
-            cmd += '| tail -n+%d' % (offset + 1)
-        if limit:
-            cmd += '| head -n %d' % limit
+    def __init__(self):
+        if settings['val_clients_backend'] == 'database':
+            self.clients = DBClientList(Database(YKVAL_DB_CONFIG_FILE))
+        else:
+            self.clients = ClientList(settings['val_clients_ttl'])
 
-        status, output = run(cmd)
-        if status != 0:
-            return []
+    def _size(self, query=None):
+        return self.clients.size(query)
 
+    def _get(self, offset=0, limit=None, query=None):
         return [{
             'id': parts[0],
             'label': '%s - %s' % (parts[0], parts[3]),
             'Client ID': parts[0],
             'Enabled': parts[1] != '0',
             'API Key': parts[3]
-        } for parts in [line.split(',') for line in output.splitlines()]]
+        } for parts in self.clients.get(offset, limit, query)]
 
     def create(self, request):
-        status, output = run('ykval-gen-clients --urandom')
-        if status == 0:
-            parts = [x.strip() for x in output.split(',')]
-            return render('val/client_created', client_id=parts[0],
-                          api_key=parts[1])
-        resp = self.list()
-        resp.data['alerts'] = [
-            {'type': 'error', 'title': 'Error generating client:',
-                'message': 'Command exited with status: %d' % status}]
-        return resp
+        try:
+            client_id, api_key = self.clients.generate()[0][:2]
+            return render('val/client_created', client_id=client_id,
+                          api_key=api_key)
+        except Exception as e:
+            log.exception('Error generating client')
+            resp = self.list()
+            resp.data['alerts'] = [
+                {'type': 'error', 'title': 'Error generating client:',
+                    'message': str(e)}]
+            return resp
+
+    def bulk_create(self, request):
+        form = BulkCreateForm()
+        alerts = []
+        # Creating clients changes state, so it is never done on a GET.
+        if request.method == 'POST' and 'count' in request.POST:
+            form.process(request.POST)
+            if form.validate():
+                clients = self.clients.generate_iter(form.count.data)
+                try:
+                    # Fail before the response starts if nothing is created.
+                    first = next(clients)
+                except Exception as e:
+                    log.exception('Error generating clients')
+                    alerts = [{'type': 'error',
+                               'title': 'Error generating clients:',
+                               'message': str(e) or 'No clients created.'}]
+                else:
+                    return Response(
+                        app_iter=clients_csv(first, clients),
+                        content_type='text/csv',
+                        content_disposition='attachment; '
+                        'filename="ykval-clients.csv"')
+            else:
+                alerts = [{'type': 'error', 'title': 'Invalid data!'}]
+        return render('val/bulk_create', form=form, alerts=alerts)
 
 app = YubikeyVal()
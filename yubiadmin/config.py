@@ -46,8 +46,33 @@ VALUES = {
     # Web interface
     'USERNAME': 'user',
     'PASSWORD': 'pass',
+    'AUTH_CACHE_TTL': 'auth_cache_ttl',
+    'AUTH_FAILURE_BURST': 'auth_failure_burst',
+    'AUTH_FAILURE_INTERVAL': 'auth_failure_interval',
     'INTERFACE': 'iface',
-    'PORT': 'port'
+    'PORT': 'port',
+    # Server
+    'ENGINE': 'engine',
+    'WORKERS': 'workers',
+    'KEEPALIVE': 'keepalive',
+    'REQUEST_TIMEOUT': 'request_timeout',
+    # Profiling
+    'PROFILE': 'profile',
+    'PROFILE_KEEP': 'profile_keep',
+    # Jobs
+    'JOB_WORKERS': 'job_workers',
+    # Apps
+    'APP_STATE_INTERVAL': 'app_state_interval',
+    # Watcher
+    'WATCH_INTERVAL': 'watch_interval',
+    # Dashboard
+    'DASHBOARD_TIMEOUT': 'dashboard_timeout',
+    # Validation server
+    'VAL_CLIENTS_TTL': 'val_clients_ttl',
+    'VAL_CLIENTS_BACKEND': 'val_clients_backend',
+    # Templates
+    'TEMPLATE_RELOAD': 'template_reload',
+    'TEMPLATE_CACHE_DIR': 'template_cache_dir'
 }
 
 
@@ -2,12 +2,68 @@
 # YubiAdmin settings
 #
 
-# Credentials needed to access the web interface
+# Credentials needed to access the web interface. The password may be given
+# as is, or hashed as written by yubiadmin-config
 USERNAME = "yubiadmin"
 PASSWORD = "yubiadmin"
 
+# Seconds to remember valid credentials before checking them again
+AUTH_CACHE_TTL = 300
+
+# Failed logins allowed at once from a single address, and the seconds it
+# takes to regain each one. A burst of 0 allows any number of attempts
+AUTH_FAILURE_BURST = 10
+AUTH_FAILURE_INTERVAL = 6
+
 # Interface to listen to
 INTERFACE = "127.0.0.1"
 
 # Listen port
 PORT = 8080
+
+# Server engine, one of "simple" (single threaded), "threaded" (a pool of
+# worker threads) or "prefork" (a number of worker processes)
+ENGINE = "threaded"
+
+# Number of worker threads or processes, for the threaded and prefork engines
+WORKERS = 8
+
+# Seconds to keep idle connections open for reuse, 0 disables keep-alive
+KEEPALIVE = 5
+
+# Seconds a client may take to send a request, or to accept a response,
+# before the connection is closed
+REQUEST_TIMEOUT = 30
+
+# Allow profiling requests by adding the _profile parameter or X-Profile
+# header, keeping the PROFILE_KEEP slowest profiles for download from /profiles
+PROFILE = False
+PROFILE_KEEP = 10
+
+# Number of background jobs, such as restarting services, run at once
+JOB_WORKERS = 2
+
+# Seconds between checks for apps having been installed or removed
+APP_STATE_INTERVAL = 10
+
+# Seconds between checks for config files having been changed outside of
+# YubiAdmin, which are noticed right away where inotify is available. 0
+# disables watching config files
+WATCH_INTERVAL = 5
+
+# Seconds to wait for the status of each app when showing the dashboard
+DASHBOARD_TIMEOUT = 5
+
+# Seconds to cache the exported list of validation server API clients
+VAL_CLIENTS_TTL = 60
+
+# Where to read validation server API clients from, either "export" (using
+# ykval-export-clients and ykval-gen-clients) or "database" (querying the
+# database configured in /etc/yubico/val/config-db.php directly)
+VAL_CLIENTS_BACKEND = "export"
+
+# Check templates for changes on each use, for when editing them
+TEMPLATE_RELOAD = False
+
+# Directory to keep compiled templates in between restarts, None to disable
+TEMPLATE_CACHE_DIR = None
@@ -0,0 +1,48 @@
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Locations of the software configured by the apps. These decide whether an
+app is enabled, which is checked before the app itself is imported, so this
+module must stay free of imports.
+"""
+
+__all__ = [
+    'AUTH_CONFIG_FILE',
+    'KSM_CONFIG_FILE',
+    'KSM_DB_CONFIG_FILE',
+    'YKVAL_CONFIG_FILE',
+    'YKVAL_DB_CONFIG_FILE',
+    'FREERADIUS_CONFIG_DIR'
+]
+
+AUTH_CONFIG_FILE = '/etc/yubico/auth/yubiauth.conf'
+KSM_CONFIG_FILE = '/etc/yubico/ksm/ykksm-config.php'
+KSM_DB_CONFIG_FILE = '/etc/yubico/ksm/config-db.php'
+YKVAL_CONFIG_FILE = '/etc/yubico/val/ykval-config.php'
+YKVAL_DB_CONFIG_FILE = '/etc/yubico/val/config-db.php'
+FREERADIUS_CONFIG_DIR = '/etc/freeradius'
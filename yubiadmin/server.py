@@ -25,65 +25,49 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import logging
 from webob import exc
 from webob.dec import wsgify
-from collections import OrderedDict
-from yubiadmin.util.app import render
-from yubiadmin.apps import apps
+from yubiadmin.util.app import render, render_fragment
+from yubiadmin.util import system
+from yubiadmin.util.metrics import MetricsMiddleware
+from yubiadmin.apps import registry
 
-
-def inspect_app(app):
-    if app.__doc__:
-        doc = app.__doc__.strip()
-        if '\n' in doc:
-            title, desc = doc.split('\n', 1)
-            desc = desc.strip()
-        else:
-            title = desc = doc
-    else:
-        title = desc = app.__class__.__name__
-
-    return {
-        'name': app.name,
-        'title': title,
-        'description': desc,
-        'disabled': bool(getattr(app, 'disabled', False)),
-        'hidden': bool(getattr(app, 'hidden', False))
-    }
+log = logging.getLogger(__name__)
 
 
 class YubiAdmin(object):
     @wsgify
     def __call__(self, request):
-        module_name = request.path_info_pop()
-
-        apps_data = OrderedDict()
-        for app in apps:
-            app_data = inspect_app(app)
-            apps_data[app_data['name']] = (app, app_data)
-        modules = [data for (_, data) in apps_data.values()]
-
-        if not module_name:
-            module_name = 'dashboard'
-
-        if not module_name in apps_data:
-            raise exc.HTTPNotFound
+        system.stats.begin_request()
+        try:
+            return self.handle(request)
+        finally:
+            log.debug('%s spawned %d processes (%.3fs)', request.path_qs,
+                      system.stats.request_spawned,
+                      system.stats.request_elapsed)
 
-        app, module = apps_data[module_name]
+    def handle(self, request):
+        module_name = request.path_info_pop() or 'dashboard'
 
-        if module['disabled']:
+        module = registry.get(module_name)
+        if module is None or module.disabled:
             raise exc.HTTPNotFound
+        request.environ['yubiadmin.app'] = module_name
 
+        modules, state = registry.snapshot()
+        # The module list only changes when apps are enabled or disabled.
         request.environ['yubiadmin.response'] = render(
             'content',
-            modules=modules,
-            module=module,
+            module_nav=render_fragment('module_nav', (module_name, state),
+                                       modules=modules, module=module),
             title='YubiAdmin - %s' % module_name
         )
 
+        app = module.app
         resp = app(request)
         if not resp:
             return request.environ['yubiadmin.response']
         return resp
 
-application = YubiAdmin()
+application = MetricsMiddleware(YubiAdmin())
@@ -19,16 +19,38 @@
 # SOFTWARE.
 
 import mimetypes
+import hashlib
+import gzip
 import os
+import threading
+from cStringIO import StringIO
 
 from webob import exc
 from webob.dec import wsgify
 from webob.response import Response
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 __all__ = [
-    'FileApp', 'DirectoryApp',
+    'FileApp', 'DirectoryApp', 'Asset', 'AssetCache', 'asset_cache',
+    'static_url',
 ]
 
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'static')
+# Served to URLs with a matching ?v= fingerprint.
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# Served otherwise, so that browsers revalidate using the ETag.
+REVALIDATE = 'no-cache'
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json',
+                'image/svg+xml', 'image/x-icon')
+MIN_COMPRESS_SIZE = 1024
+# Files up to this size are kept in memory.
+MAX_CACHED_SIZE = 256 * 1024
+
 mimetypes._winreg = None # do not load mimetypes from windows registry
 mimetypes.add_type('text/javascript', '.js') # stdlib default is application/x-javascript
 mimetypes.add_type('image/x-icon', '.ico') # not among defaults
@@ -47,6 +69,7 @@ class FileApp(object):
         kw.setdefault('content_encoding', content_encoding)
         kw.setdefault('accept_ranges', 'bytes')
         self.kw = kw
+        self._headers = {}
 
     @wsgify
     def __call__(self, req):
@@ -54,24 +77,193 @@ class FileApp(object):
             return exc.HTTPMethodNotAllowed("You cannot %s a file" %
                                             req.method)
         try:
-            stat = os.stat(self.filename)
+            asset = asset_cache.get(self.filename)
         except (IOError, OSError) as e:
             msg = "Can't open %r: %s" % (self.filename, e)
             return exc.HTTPNotFound(comment=msg)
 
-        try:
-            file = open(self.filename, 'rb')
-        except (IOError, OSError) as e:
-            msg = "You are not permitted to view this file (%s)" % e
-            return exc.HTTPForbidden(msg)
+        if req.GET.get('v') == asset.version:
+            cache_control = IMMUTABLE
+        else:
+            cache_control = REVALIDATE
+
+        variant = asset.variant(req.headers.get('Accept-Encoding'))
+        if variant is not None:
+            encoding, data = variant
+            app_iter = [data]
+        else:
+            encoding, data = None, asset.data
+            if data is not None:
+                app_iter = [data]
+            else:
+                try:
+                    file = open(self.filename, 'rb')
+                except (IOError, OSError) as e:
+                    msg = "You are not permitted to view this file (%s)" % e
+                    return exc.HTTPForbidden(msg)
+                file_wrapper = req.environ.get('wsgi.file_wrapper')
+                if file_wrapper is not None and req.range is None:
+                    # Lets the server use sendfile() or similar.
+                    app_iter = file_wrapper(file, 1 << 16)
+                else:
+                    app_iter = FileIter(file)
+
+        headerlist = self.headerlist(asset, encoding, data)
+        headerlist.append(('Cache-Control', cache_control))
+        return Response(app_iter=app_iter, headerlist=headerlist,
+                        conditional_response=True)
+
+    def headerlist(self, asset, encoding, data):
+        """Returns the headers for a version of the file, which are only
+        computed once per asset and encoding."""
+        key = (asset.key, encoding)
+        headers = self._headers.get(key)
+        if headers is None:
+            kw = dict(self.kw)
+            if encoding is not None:
+                kw['content_encoding'] = encoding
+            resp = Response(
+                content_length = len(data) if data is not None else
+                asset.size,
+                last_modified = asset.mtime,
+                etag = '%s-%s' % (asset.etag, encoding) if encoding else
+                asset.etag,
+                **kw
+            )
+            if asset.compressible:
+                resp.vary = ('Accept-Encoding',)
+            headers = resp.headerlist
+            if len(self._headers) > 8:
+                self._headers.clear()
+            self._headers[key] = headers
+        return list(headers)
+
+
+def accepts_encoding(header, encoding):
+    """Checks if an Accept-Encoding header allows the given encoding."""
+    if not header:
+        return False
+    for item in header.split(','):
+        parts = item.strip().split(';')
+        if parts[0].strip().lower() in (encoding, '*'):
+            for param in parts[1:]:
+                name, _, value = param.strip().partition('=')
+                if name == 'q':
+                    try:
+                        return float(value) > 0
+                    except ValueError:
+                        return False
+            return True
+    return False
+
+
+class Asset(object):
+    """A static file, with its ETag and compressed variants computed once.
+    Small files are also kept in memory.
+
+    Compressed variants are read from ``<filename>.gz`` (or ``.br``) if such
+    a file exists next to the original, and are otherwise compressed in
+    memory the first time they are used.
+    """
+
+    def __init__(self, filename, stat):
+        self.filename = filename
+        self.key = (stat.st_mtime, stat.st_size, stat.st_ino)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.content_type, self.content_encoding = \
+            mimetypes.guess_type(filename)
+        if self.size <= MAX_CACHED_SIZE:
+            with open(filename, 'rb') as f:
+                self.data = f.read()
+            self.etag = hashlib.md5(self.data).hexdigest()
+        else:
+            self.data = None
+            digest = hashlib.md5()
+            with open(filename, 'rb') as f:
+                for data in iter(lambda: f.read(1 << 16), b''):
+                    digest.update(data)
+            self.etag = digest.hexdigest()
+        self.version = self.etag[:10]
+        self._variants = {}
+        self._lock = threading.Lock()
+
+    @property
+    def compressible(self):
+        return (self.size >= MIN_COMPRESS_SIZE and
+                self.content_encoding is None and
+                (self.content_type or '').startswith(COMPRESSIBLE))
+
+    def _compress(self, encoding):
+        prebuilt = '%s.%s' % (self.filename,
+                              {'gzip': 'gz', 'br': 'br'}[encoding])
+        if os.path.isfile(prebuilt) and \
+                os.stat(prebuilt).st_mtime >= self.mtime:
+            with open(prebuilt, 'rb') as f:
+                return f.read()
+        data = self.data
+        if data is None:
+            with open(self.filename, 'rb') as f:
+                data = f.read()
+        if encoding == 'br':
+            return brotli.compress(data)
+        buf = StringIO()
+        # mtime=0 keeps the output, and thus the ETag, stable.
+        gz = gzip.GzipFile(filename='', mode='wb', fileobj=buf, mtime=0)
+        gz.write(data)
+        gz.close()
+        return buf.getvalue()
+
+    def variant(self, accept_encoding):
+        """Returns (encoding, data) of the best compressed variant that the
+        client accepts, or None if the file should be sent as is."""
+        if not self.compressible:
+            return None
+        for encoding in ('br', 'gzip'):
+            if encoding == 'br' and brotli is None:
+                continue
+            if accepts_encoding(accept_encoding, encoding):
+                break
+        else:
+            return None
+        data = self._variants.get(encoding)
+        if data is None:
+            with self._lock:
+                data = self._variants.get(encoding)
+                if data is None:
+                    data = self._variants[encoding] = \
+                        self._compress(encoding)
+        if len(data) >= self.size:
+            return None
+        return encoding, data
+
+
+class AssetCache(object):
+    """Keeps an `Asset` per file, which is replaced when the file changes."""
+
+    def __init__(self):
+        self._assets = {}
+
+    def get(self, filename):
+        stat = os.stat(filename)
+        asset = self._assets.get(filename)
+        if asset is None or asset.key != (stat.st_mtime, stat.st_size,
+                                          stat.st_ino):
+            asset = self._assets[filename] = Asset(filename, stat)
+        return asset
+
+
+asset_cache = AssetCache()
+
 
-        return Response(
-            app_iter = FileIter(file),
-            content_length = stat.st_size,
-            last_modified = stat.st_mtime,
-            #@@ etag
-            **self.kw
-        ).conditional_response_app
+def static_url(path):
+    """Returns the URL of a static file, fingerprinted with its content so
+    that it can be cached by browsers until it changes."""
+    try:
+        asset = asset_cache.get(os.path.join(STATIC_DIR, path.lstrip('/')))
+    except (IOError, OSError):
+        return path
+    return '%s?v=%s' % (path, asset.version)
 
 
 class FileIter(object):
@@ -128,6 +320,7 @@ class DirectoryApp(object):
             self.path += os.path.sep
         assert os.path.isdir(self.path)
         self.fileapp_kw = kw
+        self._fileapps = {}
 
     def make_fileapp(self, path):
         return FileApp(path, **self.fileapp_kw)
@@ -136,9 +329,14 @@ class DirectoryApp(object):
     def __call__(self, req):
         path = os.path.abspath(os.path.join(self.path,
                                             req.path_info.lstrip('/')))
+        # Resolved once per file. FileApp handles files which are removed.
+        fileapp = self._fileapps.get(path)
+        if fileapp is not None:
+            return fileapp
         if not os.path.isfile(path):
             return exc.HTTPNotFound(comment=path)
         elif not path.startswith(self.path):
             return exc.HTTPForbidden()
         else:
-            return self.make_fileapp(path)
+            fileapp = self._fileapps[path] = self.make_fileapp(path)
+            return fileapp
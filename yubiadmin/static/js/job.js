@@ -0,0 +1,25 @@
+$(document).ready(function() {
+	$('.job').each(function() {
+		var alert = $(this);
+
+		function poll() {
+			$.getJSON('/jobs/status', {id: alert.data('job')}).done(function(job) {
+				if(job.state == 'done') {
+					location.reload();
+				} else if(job.done) {
+					alert.removeClass('alert-info').addClass('alert-error');
+					alert.find('.message').text(job.error || job.state);
+				} else {
+					alert.find('.message').text(job.state + '...');
+					setTimeout(poll, 1000);
+				}
+			}).fail(function() {
+				// Gone, e.g. after the server was restarted.
+				alert.removeClass('alert-info').addClass('alert-error');
+				alert.find('.message').text('Job status is unavailable.');
+			});
+		}
+
+		poll();
+	});
+});
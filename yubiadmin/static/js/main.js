@@ -13,3 +13,36 @@ $(document).ready(function() {
 		}
 	});
 });
+
+$(document).ready(function() {
+	// Tell the user when the files shown were changed by someone else.
+	$('.alert.stale').each(function() {
+		var alert = $(this);
+		var files = alert.data('files');
+		var params = {path: [], version: []};
+		$.each(files, function(path, version) {
+			params.path.push(path);
+			params.version.push(version);
+		});
+
+		function poll() {
+			$.ajax('/changes', {
+				data: params,
+				dataType: 'json',
+				traditional: true,
+				cache: false
+			}).done(function(changes) {
+				if(changes.changed.length) {
+					alert.find('.message').text(changes.changed.join(', '));
+					alert.removeClass('hide');
+				} else {
+					setTimeout(poll, 5000);
+				}
+			}).fail(function() {
+				setTimeout(poll, 30000);
+			});
+		}
+
+		setTimeout(poll, 5000);
+	});
+});
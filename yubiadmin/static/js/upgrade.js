@@ -0,0 +1,24 @@
+$(document).ready(function() {
+	var offset = 0;
+	var log = $('#upgrade_log');
+
+	function poll() {
+		$.getJSON('upgrade_log', {offset: offset}).done(function(result) {
+			log.append(document.createTextNode(result.data));
+			offset = result.offset;
+			if(result.done) {
+				$('#upgrade_status').html('<strong>Update complete!</strong>');
+				setTimeout(function() {
+					window.location.replace('/sys');
+				}, 10000);
+			} else {
+				setTimeout(poll, result.data ? 0 : 1000);
+			}
+		}).fail(function() {
+			// The server may be restarting as part of the update.
+			setTimeout(poll, 5000);
+		});
+	}
+
+	poll();
+});
@@ -28,26 +28,128 @@
 import os
 import sys
 import re
-from jinja2 import Environment, FileSystemLoader
+import time
+import json
+import logging
+import threading
+from urllib import urlencode
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 from webob import exc, Response
 from webob.dec import wsgify
+from yubiadmin.config import settings
+from yubiadmin.static import static_url
+from yubiadmin.util.config import batched_commits
+from yubiadmin.util.metrics import metrics
+from yubiadmin.util.watch import watcher
 
 __all__ = [
     'App',
     'CollectionApp',
     'render',
+    'render_fragment',
+    'fragments',
     'populate_forms',
+    'precompile_templates'
 ]
 
+log = logging.getLogger(__name__)
+
+template_seconds = metrics.histogram(
+    'yubiadmin_template_render_seconds',
+    'Time taken to render templates, including any templates within them.',
+    ('template',))
+
 cwd = os.path.dirname(__file__)
 base_dir = os.path.abspath(os.path.join(cwd, os.pardir))
 template_dir = os.path.join(base_dir, 'templates')
-env = Environment(loader=FileSystemLoader(template_dir))
+
+
+def create_environment(reload=False, cache_dir=None):
+    """
+    Creates the template environment. Unless reload is set, templates are
+    never checked for changes once loaded. Compiled templates are kept in
+    cache_dir, if given, so that they don't need to be compiled on restart.
+    """
+    bytecode_cache = None
+    if cache_dir:
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        except OSError as e:
+            log.error('Not caching compiled templates: %s', e)
+    # cache_size=-1 never evicts a loaded template.
+    return Environment(loader=FileSystemLoader(template_dir),
+                       auto_reload=reload, cache_size=-1,
+                       bytecode_cache=bytecode_cache)
+
+
+env = create_environment(settings['template_reload'],
+                         settings['template_cache_dir'])
+env.globals['static_url'] = static_url
+
+
+def precompile_templates():
+    """
+    Loads all templates, so that no request has to wait for compilation.
+    Returns the number of templates and the time it took.
+    """
+    start = time.time()
+    names = env.list_templates(extensions=['html'])
+    for name in names:
+        env.get_template(name)
+    elapsed = time.time() - start
+    log.info('Loaded %d templates in %.3fs', len(names), elapsed)
+    return len(names), elapsed
+
+
+class FragmentCache(object):
+    """
+    Keeps rendered templates whose output depends only on a known key, such as
+    the navigation, so that they are rendered once rather than per request.
+    """
+    max_size = 256
+
+    def __init__(self):
+        self._fragments = {}
+        self._lock = threading.Lock()
+
+    def get(self, template, key, render):
+        cache_key = (template, key)
+        try:
+            return self._fragments[cache_key]
+        except KeyError:
+            pass
+        value = render()
+        with self._lock:
+            if len(self._fragments) >= self.max_size:
+                self._fragments.clear()
+            self._fragments[cache_key] = value
+        return value
+
+    def invalidate(self, template=None):
+        with self._lock:
+            if template is None:
+                self._fragments.clear()
+            else:
+                for cache_key in self._fragments.keys():
+                    if cache_key[0] == template:
+                        del self._fragments[cache_key]
+
+
+fragments = FragmentCache()
 
 
 class TemplateBinding(object):
-    def __init__(self, template, **kwargs):
+    """
+    A template together with the data to render it with. If cache_key is
+    given, it must identify all data the output depends on, and the output is
+    rendered once and reused for bindings with the same template and key.
+    """
+    def __init__(self, template, cache_key=None, **kwargs):
+        self.name = template
         self.template = env.get_template('%s.html' % template)
+        self.cache_key = cache_key
         self.data = kwargs
         for (key, val) in kwargs.items():
             if isinstance(val, TemplateBinding):
@@ -67,7 +169,13 @@ class TemplateBinding(object):
     def __str__(self):
         if hasattr(self, '_rendered'):
             return self._rendered
-        return self.template.render(self.data)
+        if self.cache_key is not None and not env.auto_reload:
+            return fragments.get(self.name, self.cache_key, self._render)
+        return self._render()
+
+    def _render(self):
+        with template_seconds.time((self.name,)):
+            return self.template.render(self.data)
 
     @wsgify
     def __call__(self, request):
@@ -78,6 +186,10 @@ def render(tmpl, **kwargs):
     return TemplateBinding(tmpl, **kwargs)
 
 
+def render_fragment(tmpl, cache_key, **kwargs):
+    return TemplateBinding(tmpl, cache_key, **kwargs)
+
+
 def populate_forms(forms, data):
     if not data:
         for form in filter(lambda x: hasattr(x, 'load'), forms):
@@ -88,8 +200,9 @@ def populate_forms(forms, data):
             form.process(data)
             errors = not form.validate() or errors
         if not errors:
-            for form in filter(lambda x: hasattr(x, 'save'), forms):
-                form.save()
+            with batched_commits():
+                for form in filter(lambda x: hasattr(x, 'save'), forms):
+                    form.save()
 
 
 class App(object):
@@ -110,20 +223,17 @@ class App(object):
 
         if not hasattr(self, section_name):
             raise exc.HTTPNotFound
+        request.environ['yubiadmin.section'] = section_name
 
-        sections = [{
-            'name': section,
-            'title': (getattr(self, section).__doc__ or section.capitalize()
-                      ).strip(),
-            'active': section == section_name,
-            'advanced': bool(getattr(getattr(self, section), 'advanced',
-                                     False))
-        } for section in self.sections]
+        sections = [dict(section, active=section['name'] == section_name)
+                    for section in self._section_table()]
 
+        section_nav = render_fragment('section_nav', (self.name, section_name),
+                                      name=self.name, sections=sections)
         request.environ['yubiadmin.response'].extend('content', render(
             'app_base',
             name=self.name,
-            sections=sections,
+            section_nav=section_nav,
             title='YubiAdmin - %s - %s' % (self.name, section_name)
         ))
 
@@ -132,34 +242,61 @@ class App(object):
             return resp
         request.environ['yubiadmin.response'].extend('page', resp)
 
+    def _section_table(self):
+        """
+        Returns the name, title and placement of each section, which are only
+        computed again if the list of sections changes.
+        """
+        sections = tuple(self.sections)
+        cached = self.__dict__.get('_sections')
+        if cached is None or cached[0] != sections:
+            cached = self._sections = (sections, [{
+                'name': section,
+                'title': (getattr(self, section).__doc__ or
+                          section.capitalize()).strip(),
+                'advanced': bool(getattr(getattr(self, section), 'advanced',
+                                         False))
+            } for section in sections])
+        return cached[1]
+
     def redirect(self, url):
         raise exc.HTTPSeeOther(location=url)
 
     def render_forms(self, request, forms, template='form',
                      success_msg='Settings updated!', **kwargs):
         alerts = []
-        if not request.params:
+        # Only a POST saves, so that following a link can't change anything.
+        if request.method != 'POST' or not request.POST:
             for form in filter(lambda x: hasattr(x, 'load'), forms):
                 form.load()
         else:
             errors = False
             for form in forms:
-                form.process(request.params)
+                form.process(request.POST)
                 errors = not form.validate() or errors
             if not errors:
                 try:
                     if success_msg:
                         alerts = [{'type': 'success', 'title': success_msg}]
-                    for form in filter(lambda x: hasattr(x, 'save'), forms):
-                        form.save()
+                    # Forms sharing a config file result in a single write.
+                    with batched_commits():
+                        for form in filter(lambda x: hasattr(x, 'save'),
+                                           forms):
+                            form.save()
                 except Exception as e:
                     alerts = [{'type': 'error', 'title': 'Error:',
                                'message': str(e)}]
             else:
                 alerts = [{'type': 'error', 'title': 'Invalid data!'}]
 
+        # Lets the page tell if the files are changed by someone else.
+        versions = dict((form.config.filename,
+                         watcher.version(form.config.filename))
+                        for form in forms
+                        if hasattr(getattr(form, 'config', None), 'filename'))
         return render(template, target=request.path, fieldsets=forms,
-                      alerts=alerts, **kwargs)
+                      alerts=alerts,
+                      watch_files=versions and json.dumps(versions), **kwargs)
 
 
 ITEM_RANGE = re.compile('(\d+)-(\d+)')
@@ -173,6 +310,8 @@ class CollectionApp(App):
     template = 'table'
     scripts = ['table']
     selectable = True
+    # Apps which set this must accept a query keyword in _get and _size.
+    searchable = False
     max_limit = 100
 
     def _size(self):
@@ -192,28 +331,36 @@ class CollectionApp(App):
         if sub_cmd and not sub_cmd.startswith('_') and hasattr(self, sub_cmd):
             return getattr(self, sub_cmd)(request)
         else:
+            query = request.params.get('q', '').strip() \
+                if self.searchable else ''
             match = ITEM_RANGE.match(sub_cmd) if sub_cmd else None
             if match:
                 offset = int(match.group(1)) - 1
                 limit = int(match.group(2)) - offset
-                return self.list(offset, limit)
+                return self.list(offset, limit, query)
             else:
-                return self.list()
+                return self.list(query=query)
 
-    def list(self, offset=0, limit=10):
+    def list(self, offset=0, limit=10, query=''):
         limit = min(self.max_limit, limit)
-        items = self._get(offset, limit)
-        total = self._size()
+        if query:
+            items = self._get(offset, limit, query=query)
+            total = self._size(query=query)
+            suffix = '?' + urlencode({'q': query.encode('utf-8')})
+        else:
+            items = self._get(offset, limit)
+            total = self._size()
+            suffix = ''
         shown = (min(offset + 1, total), min(offset + limit, total))
         if offset > 0:
             st = max(0, offset - limit)
             ed = st + limit
-            prev = '%s/%d-%d' % (self.base_url, st + 1, ed)
+            prev = '%s/%d-%d%s' % (self.base_url, st + 1, ed, suffix)
         else:
             prev = None
         if total > shown[1]:
-            next = '%s/%d-%d' % (self.base_url, offset + limit + 1, shown[1]
-                                 + limit)
+            next = '%s/%d-%d%s' % (self.base_url, offset + limit + 1,
+                                   shown[1] + limit, suffix)
         else:
             next = None
 
@@ -222,7 +369,8 @@ class CollectionApp(App):
             limit=limit, total=total, shown='%d-%d' % shown, prev=prev,
             next=next, base_url=self.base_url, caption=self.caption,
             cols=self.columns, item_name=self.item_name,
-            selectable=self.selectable)
+            selectable=self.selectable, searchable=self.searchable,
+            query=query)
 
     def delete(self, request):
         ids = [x[5:] for x in request.params if request.params[x] == 'on']
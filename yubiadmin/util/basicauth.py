@@ -0,0 +1,222 @@
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import time
+import hmac
+import base64
+import hashlib
+import logging
+import threading
+from webob import Response, exc
+
+__all__ = [
+    'BasicAuth',
+    'TokenBucket',
+    'hash_password',
+    'is_password_hash',
+    'check_password'
+]
+
+log = logging.getLogger(__name__)
+
+HASH_PREFIX = 'pbkdf2_sha256'
+HASH_ITERATIONS = 100000
+
+
+def hash_password(password, salt=None, iterations=HASH_ITERATIONS):
+    """
+    Returns a salted PBKDF2 hash of password, which can be stored in
+    yubiadmin.conf in place of the password itself.
+    """
+    if isinstance(password, unicode):
+        password = password.encode('utf-8')
+    if salt is None:
+        salt = base64.b64encode(os.urandom(12))
+    digest = hashlib.pbkdf2_hmac('sha256', password, salt, iterations)
+    return '%s$%d$%s$%s' % (HASH_PREFIX, iterations, salt,
+                            base64.b64encode(digest))
+
+
+def is_password_hash(value):
+    return isinstance(value, basestring) and \
+        value.startswith(HASH_PREFIX + '$') and value.count('$') == 3
+
+
+def check_password(password, stored):
+    """
+    Checks password against a stored password, hashed or not, in constant
+    time.
+    """
+    if isinstance(password, unicode):
+        password = password.encode('utf-8')
+    if isinstance(stored, unicode):
+        stored = stored.encode('utf-8')
+    if is_password_hash(stored):
+        _, iterations, salt, _ = stored.split('$')
+        return hmac.compare_digest(
+            hash_password(password, salt, int(iterations)), stored)
+    return hmac.compare_digest(password, stored)
+
+
+class TokenBucket(object):
+    """
+    Allows burst events at once, refilling at one per interval seconds.
+    """
+    def __init__(self, burst, interval):
+        self.burst = burst
+        self.interval = interval
+        self.tokens = float(burst)
+        self.updated = time.time()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens +
+                          (now - self.updated) / self.interval)
+        self.updated = now
+
+    @property
+    def full(self):
+        return self.tokens >= self.burst
+
+    def available(self, now):
+        self.refill(now)
+        return self.tokens >= 1
+
+    def take(self, now):
+        self.refill(now)
+        self.tokens -= 1
+
+    def wait(self):
+        """Seconds until a token is available."""
+        return max(0, (1 - self.tokens) * self.interval)
+
+
+class BasicAuth(object):
+    """
+    WSGI middleware requiring HTTP Basic authentication.
+
+    Successfully verified credentials are remembered for cache_ttl seconds,
+    so that a hashed password only needs to be checked once in a while rather
+    than for every request. Failed attempts are limited per client address
+    by a token bucket, and clients which run out are answered with 429
+    without their credentials being checked. A failure_burst of 0 disables
+    the limit.
+    """
+    max_entries = 10000
+
+    def __init__(self, app, username, password, realm, cache_ttl=300,
+                 failure_burst=10, failure_interval=6):
+        self.app = app
+        self.username = username.encode('utf-8') \
+            if isinstance(username, unicode) else username
+        self.password = password
+        self.realm = realm
+        self.cache_ttl = cache_ttl
+        self.failure_burst = failure_burst
+        self.failure_interval = failure_interval
+        # Keyed on an HMAC of the header, so no credentials are kept.
+        self._key = os.urandom(32)
+        self._verified = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _token(self, header):
+        return hmac.new(self._key, header, hashlib.sha256).digest()
+
+    def _check(self, header):
+        try:
+            scheme, credentials = header.split(None, 1)
+            if scheme.lower() != 'basic':
+                return False
+            username, password = base64.b64decode(credentials).split(':', 1)
+        except (ValueError, TypeError):
+            return False
+        # Check both, so that timing doesn't tell whether the name is right.
+        valid_user = hmac.compare_digest(username, self.username)
+        return check_password(password, self.password) and valid_user
+
+    def _prune(self, now):
+        for token, expires in self._verified.items():
+            if expires <= now:
+                del self._verified[token]
+        for address, bucket in self._buckets.items():
+            bucket.refill(now)
+            if bucket.full:
+                del self._buckets[address]
+
+    def authenticate(self, header, address):
+        """
+        Returns True if the Authorization header is valid, False if not, or
+        the number of seconds to wait if address has made too many failed
+        attempts.
+        """
+        now = time.time()
+        token = self._token(header)
+        expires = self._verified.get(token)
+        if expires is not None and expires > now:
+            return True
+
+        with self._lock:
+            bucket = self._buckets.get(address)
+            if bucket is not None and not bucket.available(now):
+                return bucket.wait() or 1
+        if self._check(header):
+            with self._lock:
+                if len(self._verified) >= self.max_entries:
+                    self._prune(now)
+                self._verified[token] = now + self.cache_ttl
+            return True
+
+        log.warning('Failed authentication from %s', address)
+        if not self.failure_burst:
+            return False
+        with self._lock:
+            if bucket is None:
+                if len(self._buckets) >= self.max_entries:
+                    self._prune(now)
+                bucket = self._buckets.setdefault(
+                    address, TokenBucket(self.failure_burst,
+                                         self.failure_interval))
+            bucket.take(now)
+        return False
+
+    def __call__(self, environ, start_response):
+        header = environ.get('HTTP_AUTHORIZATION')
+        if header:
+            result = self.authenticate(header,
+                                       environ.get('REMOTE_ADDR', ''))
+            if result is True:
+                return self.app(environ, start_response)
+            elif result is not False:
+                response = Response('Too many failed login attempts.',
+                                    status='429 Too Many Requests',
+                                    content_type='text/plain')
+                response.retry_after = int(result) + 1
+                return response(environ, start_response)
+        response = exc.HTTPUnauthorized()
+        response.www_authenticate = ('Basic', {'realm': self.realm})
+        return response(environ, start_response)
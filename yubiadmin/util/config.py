@@ -27,16 +27,33 @@
 
 import os
 import re
+import time
 import errno
 import csv
 import logging
-from collections import MutableMapping, OrderedDict
+import tempfile
+import threading
+from copy import copy
+from contextlib import contextmanager
+from weakref import WeakKeyDictionary
+from collections import MutableMapping, OrderedDict, namedtuple
+from yubiadmin.util.metrics import metrics
+from yubiadmin.util.watch import watcher
 
 __all__ = [
     'RegexHandler',
+    'PHPHandler',
+    'PHPIndex',
+    'FileCache',
     'FileConfig',
+    'file_cache',
+    'write_file',
+    'write_stats',
+    'batched_commits',
+    'after_commit',
     'strip_comments',
     'php_inserter',
+    'php_index',
     'python_handler',
     'python_list_handler',
     'parse_block',
@@ -51,6 +68,18 @@ COMMENTS = re.compile(
     r'#.*?$|//.*?$|/\*.*?\*/|\'(?:\\.|[^\\\'])*\'|"(?:\\.|[^\\"])*"',
     re.DOTALL | re.MULTILINE
 )
+PHP_COMMENT = r'#[^\n]*|//[^\n]*|/\*.*?\*/'
+PHP_STRING = r'\'(?:\\.|[^\\\'])*\'|"(?:\\.|[^\\"])*"'
+# Assigned values, with strings, comments and up to two levels of parentheses.
+PHP_VALUE = r'(?:[^;()\'"#/]|/(?![/*])|%(s)s|%(c)s|\(' \
+    r'(?:[^()\'"#/]|/(?![/*])|%(s)s|%(c)s|\((?:[^()\'"]|%(s)s)*\))*\))*' % {
+        's': PHP_STRING, 'c': PHP_COMMENT}
+PHP_TOKENS = re.compile(
+    r'%s|%s|\$(?P<var>\w+)(?:\s*\[\s*(?P<key>\'[^\']*\'|"[^"]*")\s*\])?'
+    r'\s*=(?![=>])(?:(?P<value>%s);)?' % (PHP_COMMENT, PHP_STRING, PHP_VALUE),
+    re.DOTALL)
+PHP_VALUE_TOKENS = re.compile(r'%s|%s|[();]' % (PHP_COMMENT, PHP_STRING),
+                              re.DOTALL)
 
 
 def php_inserter(content, value):
@@ -65,6 +94,119 @@ def php_inserter(content, value):
     return content
 
 
+Assignment = namedtuple('Assignment', 'start end value_start value_end')
+
+
+def _statement_end(content, pos):
+    depth = 0
+    search = PHP_VALUE_TOKENS.search
+    match = search(content, pos)
+    while match:
+        token = match.group()
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            if depth == 0:
+                # Not a statement, e.g. an assignment in a condition.
+                return None
+            depth -= 1
+        elif token == ';' and depth == 0:
+            return match.start()
+        match = search(content, match.end())
+    return None
+
+
+class PHPIndex(object):
+    """
+    Index of the variable assignments in a PHP source, built by tokenizing it
+    once. Assignments are keyed by (variable, array key) and hold the offsets
+    of the full statement as well as of the assigned value.
+    Comments and strings are skipped, and only the first assignment to each
+    variable is kept.
+    """
+    def __init__(self, content):
+        self.content = content
+        self.assignments = {}
+        # Replaced assignments, and the offset shifts caused by replacing.
+        self._replaced = {}
+        self._shifts = []
+        search = PHP_TOKENS.search
+        match = search(content)
+        while match:
+            pos = match.end()
+            varname = match.group('var')
+            if varname:
+                if match.group('value') is not None:
+                    end = pos - 1
+                    value_start = match.start('value')
+                else:
+                    # Nested too deep for PHP_VALUE, find the end manually.
+                    value_start = pos
+                    end = _statement_end(content, pos)
+                if end is not None:
+                    key = match.group('key')
+                    self.assignments.setdefault(
+                        (varname, key and key[1:-1]),
+                        Assignment(match.start(), end + 1, value_start, end))
+                    pos = end + 1
+            match = search(content, pos)
+
+    def get(self, varname, key=None):
+        assignment, shifts = self._replaced.get((varname, key), (None, 0))
+        if assignment is None:
+            assignment = self.assignments.get((varname, key))
+            if assignment is None:
+                return None
+        for (pos, delta) in self._shifts[shifts:]:
+            if assignment.start >= pos:
+                assignment = Assignment(*[x + delta for x in assignment])
+        return assignment
+
+    def value(self, varname, key=None):
+        assignment = self.get(varname, key)
+        if assignment:
+            return self.content[assignment.value_start:
+                                assignment.value_end].strip()
+        return None
+
+    def replace(self, varname, key, statement):
+        """
+        Returns the index of the content resulting from replacing an
+        assignment with a new statement, without re-tokenizing the content.
+        """
+        old = self.get(varname, key)
+        new = PHPIndex(statement).get(varname, key)
+        content = self.content[:old.start] + statement + \
+            self.content[old.end:]
+        if new is None:
+            return PHPIndex(content)
+        index = PHPIndex.__new__(PHPIndex)
+        index.content = content
+        index.assignments = self.assignments
+        index._shifts = self._shifts + [
+            (old.start, len(statement) - (old.end - old.start))]
+        index._replaced = dict(self._replaced)
+        index._replaced[(varname, key)] = (
+            Assignment(*[x + old.start for x in new]), len(index._shifts))
+        return index
+
+
+_last_index = None
+
+
+def php_index(content):
+    """
+    Returns a PHPIndex for the content, reusing the last one built if it is
+    for the very same string, so handlers reading several values from one
+    file share a single tokenization.
+    """
+    global _last_index
+    index = _last_index
+    if index is None or index.content is not content:
+        index = _last_index = PHPIndex(content)
+    return index
+
+
 def python_handler(varname, default):
     pattern = r'(?sm)^\s*%s\s*=\s*(.*?)\s*$' % varname
     reader = lambda match: parse_value(match.group(1))
@@ -177,9 +319,12 @@ class RegexHandler(object):
     def write(self, content, value):
         if value is None:
             value = ''
-        if self.pattern.search(content):
-            new_content = self.pattern.sub(self.writer(value), content, 1)
-            if self.read(content) == self.read(new_content):
+        match = self.pattern.search(content)
+        if match:
+            new_content = content[:match.start()] + self.writer(value) + \
+                content[match.end():]
+            new_match = self.pattern.search(new_content, match.start())
+            if new_match and self.reader(match) == self.reader(new_match):
                 #Value remains unchanged, don't re-write it.
                 return content
             else:
@@ -188,22 +333,273 @@ class RegexHandler(object):
             return self.inserter(content, self.writer(value))
 
 
+class PHPHandler(object):
+    """
+    Reads and writes the value assigned to a PHP variable, or to a key of a PHP
+    array. The reader is given the source text of the assigned value, and the
+    writer should return a complete assignment statement.
+    """
+    def __init__(self, varname, writer, reader=lambda x: x, key=None,
+                 inserter=php_inserter, default=None):
+        self.varname = varname
+        self.key = key
+        self.writer = writer
+        self.reader = reader
+        self.inserter = inserter
+        self.default = default
+
+    def read(self, content):
+        value = php_index(content).value(self.varname, self.key)
+        if value is not None:
+            return self.reader(value)
+        return self.default
+
+    def write(self, content, value):
+        global _last_index
+        if value is None:
+            value = ''
+        statement = self.writer(value)
+        index = php_index(content)
+        if index.get(self.varname, self.key) is None:
+            return self.inserter(content, statement)
+        new_value = PHPIndex(statement).value(self.varname, self.key)
+        if new_value is not None and \
+                self.read(content) == self.reader(new_value):
+            #Value remains unchanged, don't re-write it.
+            return content
+        _last_index = index.replace(self.varname, self.key, statement)
+        return _last_index.content
+
+
+class CachedFile(object):
+    def __init__(self, key, content):
+        self.key = key
+        self.content = content
+        self.parsed = WeakKeyDictionary()
+
+    def memo(self, parser):
+        """
+        Returns parser(content), computed once per version of the file.
+        """
+        try:
+            return self.parsed[parser]
+        except KeyError:
+            value = self.parsed[parser] = parser(self.content)
+            return value
+
+
+class FileCache(object):
+    """
+    Process wide cache of file contents, validated against stat() on each
+    lookup so that a file is only re-read once it has changed on disk.
+    Entries are also dropped as soon as the watcher reports a change.
+    """
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, filename):
+        stat = os.stat(filename)
+        key = (stat.st_mtime, stat.st_size, stat.st_ino)
+        entry = self._entries.get(filename)
+        if entry is None or entry.key != key:
+            with open(filename, 'r') as file:
+                entry = CachedFile(key, unicode(file.read()))
+            self._entries[filename] = entry
+        return entry
+
+    def invalidate(self, filename=None):
+        if filename is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(filename, None)
+
+
+file_cache = FileCache()
+watcher.subscribe(file_cache.invalidate)
+
+
+class WriteStats(object):
+    """
+    Counts config file writes, skipped identical writes, and time spent.
+    """
+    def __init__(self):
+        self.written = 0
+        self.skipped = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, filename, written, elapsed):
+        log.debug('%s %s in %.3fs', 'Wrote' if written else 'Unchanged',
+                  filename, elapsed)
+        with self._lock:
+            if written:
+                self.written += 1
+            else:
+                self.skipped += 1
+            self.elapsed += elapsed
+        write_seconds.observe(elapsed, (filename, 'written' if written
+                                        else 'unchanged'))
+
+
+write_stats = WriteStats()
+
+read_seconds = metrics.histogram(
+    'yubiadmin_config_read_seconds', 'Time taken to read config files.',
+    ('file',))
+write_seconds = metrics.histogram(
+    'yubiadmin_config_write_seconds',
+    'Time taken to write config files, or to find them unchanged.',
+    ('file', 'result'))
+
+# Permissions for new files, as open() would have created them.
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+def _fsync_dir(dirname):
+    try:
+        fd = os.open(dirname, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_file(filename, content):
+    """
+    Replaces the content of filename atomically, by writing to a temporary
+    file which is synced and renamed over it, keeping the mode and owner of
+    the existing file. Nothing is written if the content is unchanged.
+    Line breaks are normalized to os.linesep.
+    """
+    start = time.time()
+    content = os.linesep.join(content.splitlines())
+    try:
+        if file_cache.get(filename).content == content:
+            write_stats.record(filename, False, time.time() - start)
+            return False
+        stat = os.stat(filename)
+    except (IOError, OSError):
+        stat = None
+    dirname = os.path.dirname(filename) or os.curdir
+    try:
+        os.makedirs(dirname)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise e
+    fd, tmpname = tempfile.mkstemp(dir=dirname,
+                                   prefix='.%s.' % os.path.basename(filename))
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        if stat:
+            os.chmod(tmpname, stat.st_mode & 0o7777)
+            try:
+                os.chown(tmpname, stat.st_uid, stat.st_gid)
+            except OSError:
+                pass
+        else:
+            os.chmod(tmpname, 0o666 & ~_umask)
+        os.rename(tmpname, filename)
+    except:
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+        raise
+    _fsync_dir(dirname)
+    file_cache.invalidate(filename)
+    write_stats.record(filename, True, time.time() - start)
+    return True
+
+
+class _Batch(threading.local):
+    pending = None
+    callbacks = None
+
+
+_batch = _Batch()
+
+
+@contextmanager
+def batched_commits():
+    """
+    Defers FileConfig commits made by this thread within the block, so that
+    each file is written only once, when the block exits. If the block raises,
+    nothing is written. Nested blocks join the outermost one.
+    """
+    if _batch.pending is not None:
+        yield
+        return
+    _batch.pending = OrderedDict()
+    _batch.callbacks = []
+    try:
+        yield
+        pending, callbacks = _batch.pending, _batch.callbacks
+    finally:
+        _batch.pending = _batch.callbacks = None
+    for filename, content in pending.items():
+        write_file(filename, content)
+    for callback in callbacks:
+        callback()
+
+
+def after_commit(callback):
+    """
+    Calls callback once pending commits have been written, or right away if
+    commits aren't being batched.
+    """
+    if _batch.callbacks is not None:
+        _batch.callbacks.append(callback)
+    else:
+        callback()
+
+
 class FileConfig(MutableMapping):
     """
     Maps key-value pairs to a backing config file.
     You can manually edit the file by modifying self.content.
+    The content is kept per thread, as instances are shared between requests.
     """
     def __init__(self, filename, params=[]):
         self.filename = filename
         self.params = OrderedDict()
+        self._local = threading.local()
+        watcher.watch(filename)
         for param in params:
             self.add_param(*param)
 
+    @property
+    def content(self):
+        return self._local.content
+
+    @content.setter
+    def content(self, value):
+        self._local.content = value
+        self._local.values = WeakKeyDictionary()
+
     def read(self):
+        pending = _batch.pending
+        if pending is not None and self.filename in pending:
+            # Keep edits which are waiting to be written in this batch.
+            self.content = pending[self.filename]
+            return
+        with read_seconds.time((self.filename,)):
+            self._read()
+
+    def _read(self):
         try:
-            with open(self.filename, 'r') as file:
-                self.content = unicode(file.read())
-        except IOError as e:
+            entry = file_cache.get(self.filename)
+            self._local.content = entry.content
+            # Parsed values are shared by everyone reading this version.
+            self._local.values = entry.parsed
+        except (IOError, OSError) as e:
             log.error(e)
             self.content = u''
             #Initialize all params from default values.
@@ -211,16 +607,11 @@ class FileConfig(MutableMapping):
                 self[key] = self[key]
 
     def commit(self):
-        if not os.path.isfile(self.filename):
-            dir = os.path.dirname(self.filename)
-            try:
-                os.makedirs(dir)
-            except OSError as e:
-                if e.errno != errno.EEXIST:
-                    raise e
-        with open(self.filename, 'w+') as file:
-            #Fix all linebreaks
-            file.write(os.linesep.join(self.content.splitlines()))
+        pending = _batch.pending
+        if pending is not None:
+            pending[self.filename] = self.content
+        else:
+            write_file(self.filename, self.content)
 
     def add_param(self, key, handler):
         self.params[key] = handler
@@ -232,10 +623,19 @@ class FileConfig(MutableMapping):
         return len(self.params)
 
     def __getitem__(self, key):
-        return self.params[key].read(self.content)
+        handler = self.params[key]
+        values = self._local.values
+        try:
+            value = values[handler]
+        except KeyError:
+            value = values[handler] = handler.read(self.content)
+        # Don't let callers modify the memoized value.
+        return copy(value) if isinstance(value, (list, dict)) else value
 
     def __setitem__(self, key, value):
-        self.content = self.params[key].write(self.content, value)
+        content = self.params[key].write(self.content, value)
+        if content != self.content:
+            self.content = content
 
     def keys(self):
         return self.params.keys()
@@ -0,0 +1,248 @@
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import re
+import logging
+from threading import Lock
+from contextlib import contextmanager
+from Queue import Queue, Empty, Full
+from yubiadmin.util.config import file_cache
+
+__all__ = [
+    'DatabaseError',
+    'IntegrityError',
+    'ConnectionPool',
+    'Database',
+    'parse_dbconfig'
+]
+
+log = logging.getLogger(__name__)
+
+DBCONFIG_VALUE = re.compile(r'(?m)^\$(\w+)\s*=\s*\'(.*)\';')
+
+
+class DatabaseError(Exception):
+    pass
+
+
+class IntegrityError(DatabaseError):
+    """
+    A statement violated a constraint, such as a duplicate key.
+    """
+    pass
+
+
+def parse_dbconfig(content):
+    """
+    Parses a dbconfig-common generated PHP file into a dict.
+    """
+    return dict(DBCONFIG_VALUE.findall(content))
+
+
+def _connect_mysql(conf):
+    import MySQLdb
+    kwargs = {'host': conf.get('dbserver') or 'localhost',
+              'db': conf.get('dbname', ''),
+              'user': conf.get('dbuser', ''),
+              'passwd': conf.get('dbpass', '')}
+    if conf.get('dbport'):
+        kwargs['port'] = int(conf['dbport'])
+    return MySQLdb.connect(**kwargs)
+
+
+def _connect_pgsql(conf):
+    import psycopg2
+    kwargs = {'host': conf.get('dbserver') or 'localhost',
+              'database': conf.get('dbname', ''),
+              'user': conf.get('dbuser', ''),
+              'password': conf.get('dbpass', '')}
+    if conf.get('dbport'):
+        kwargs['port'] = int(conf['dbport'])
+    return psycopg2.connect(**kwargs)
+
+
+def _connect_sqlite3(conf):
+    import sqlite3
+    return sqlite3.connect(os.path.join(conf.get('basepath', ''),
+                                        conf.get('dbname', '')),
+                           check_same_thread=False)
+
+
+def _open(connect, conf):
+    try:
+        return connect(conf)
+    except ImportError as e:
+        raise DatabaseError('No driver for %s: %s' % (conf.get('dbtype'), e))
+
+
+# dbtype: (connect, parameter placeholder)
+DRIVERS = {
+    'mysql': (_connect_mysql, '%s'),
+    'pgsql': (_connect_pgsql, '%s'),
+    'sqlite3': (_connect_sqlite3, '?'),
+}
+
+
+class ConnectionPool(object):
+    """
+    Keeps up to size idle connections around for reuse.
+    """
+    placeholder = '%s'
+
+    def __init__(self, connect, size=4):
+        self.connect = connect
+        self._idle = Queue(size)
+
+    @contextmanager
+    def connection(self):
+        """
+        Yields a connection, committing when the block exits normally and
+        rolling back if it raises. Broken connections are not reused.
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except Empty:
+            conn = self.connect()
+        try:
+            yield conn
+            conn.commit()
+        except:
+            try:
+                conn.rollback()
+            except Exception:
+                conn.close()
+                raise
+            self._release(conn)
+            raise
+        self._release(conn)
+
+    def _release(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                return
+
+
+class Database(object):
+    """
+    Database described by a dbconfig-common PHP file. Connections are pooled,
+    and the pool is replaced whenever the settings in the file change.
+    """
+    def __init__(self, filename, pool_size=4):
+        self.filename = filename
+        self.pool_size = pool_size
+        self._conf = None
+        self._pool = None
+        self._lock = Lock()
+
+    def _get_pool(self):
+        try:
+            conf = file_cache.get(self.filename).memo(parse_dbconfig)
+        except (IOError, OSError) as e:
+            raise DatabaseError('Unable to read %s: %s' % (self.filename, e))
+        with self._lock:
+            if conf != self._conf:
+                dbtype = conf.get('dbtype', 'mysql')
+                if dbtype not in DRIVERS:
+                    raise DatabaseError('Unsupported database type: %s' %
+                                        dbtype)
+                connect, placeholder = DRIVERS[dbtype]
+                if self._pool is not None:
+                    self._pool.close()
+                self._pool = ConnectionPool(lambda: _open(connect, conf),
+                                            self.pool_size)
+                self._pool.placeholder = placeholder
+                self._conf = conf
+            return self._pool
+
+    @property
+    def dbtype(self):
+        self._get_pool()
+        return self._conf.get('dbtype', 'mysql')
+
+    @contextmanager
+    def cursor(self):
+        """
+        Yields a cursor for running statements in a single transaction.
+        Statements use %s for parameters, whatever the database type.
+        """
+        pool = self._get_pool()
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield Cursor(cursor, pool.placeholder)
+            finally:
+                cursor.close()
+
+    def query(self, sql, params=()):
+        with self.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+
+@contextmanager
+def _integrity_errors():
+    # Each driver has its own IntegrityError, as named by DB-API 2.0.
+    try:
+        yield
+    except Exception as e:
+        if type(e).__name__ == 'IntegrityError':
+            raise IntegrityError(e)
+        raise
+
+
+class Cursor(object):
+    """
+    Wraps a DB-API cursor, translating %s placeholders for the driver.
+    """
+    def __init__(self, cursor, placeholder):
+        self._cursor = cursor
+        self._placeholder = placeholder
+
+    def _sql(self, sql):
+        if self._placeholder != '%s':
+            return sql.replace('%s', self._placeholder)
+        return sql
+
+    def execute(self, sql, params=()):
+        with _integrity_errors():
+            return self._cursor.execute(self._sql(sql), params)
+
+    def executemany(self, sql, seq_of_params):
+        with _integrity_errors():
+            return self._cursor.executemany(self._sql(sql), seq_of_params)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
@@ -0,0 +1,333 @@
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import errno
+import signal
+import socket
+import logging
+import threading
+from Queue import Queue
+from wsgiref import simple_server
+from wsgiref.simple_server import WSGIRequestHandler, ServerHandler
+
+__all__ = [
+    'ENGINES',
+    'KeepAliveRequestHandler',
+    'WSGIServer',
+    'ThreadPoolWSGIServer',
+    'PreforkWSGIServer',
+    'make_server',
+    'serve'
+]
+
+log = logging.getLogger(__name__)
+
+SHUTDOWN_TIMEOUT = 10
+
+
+class LimitedInput(object):
+    """
+    Wraps the connection input so that the application can't read past the
+    request body, and so that any unread part can be discarded before the next
+    request on the same connection is handled.
+    """
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size) if size else ''
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.readline(size) if size else ''
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=None):
+        return list(self)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def discard(self, limit=1 << 16):
+        while 0 < self.remaining <= limit:
+            if not self.read(min(self.remaining, 8192)):
+                break
+        return self.remaining == 0
+
+
+class KeepAliveServerHandler(ServerHandler):
+    http_version = '1.1'
+
+    def cleanup_headers(self):
+        ServerHandler.cleanup_headers(self)
+        request_handler = self.request_handler
+        if 'Content-Length' not in self.headers:
+            # No way of delimiting the body other than closing.
+            request_handler.close_connection = 1
+        if request_handler.close_connection:
+            self.headers['Connection'] = 'close'
+        elif request_handler.request_version == 'HTTP/1.0':
+            self.headers['Connection'] = 'keep-alive'
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """
+    Request handler which serves multiple requests over a single connection,
+    for as long as the client and the response allows it.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        self.timeout = self.server.request_timeout
+        WSGIRequestHandler.setup(self)
+
+    def address_string(self):
+        return str(self.client_address[0])
+
+    def handle(self):
+        self.close_connection = 1
+        self.handle_one_request()
+        while not self.close_connection and not self.server.stopping:
+            self.handle_one_request(idle_timeout=self.server.keepalive)
+
+    def handle_one_request(self, idle_timeout=None):
+        try:
+            if idle_timeout:
+                # Waiting for the next request on a kept-alive connection.
+                self.connection.settimeout(idle_timeout)
+            self.raw_requestline = self.rfile.readline(65537)
+        except socket.timeout:
+            self.close_connection = 1
+            return
+        finally:
+            if idle_timeout:
+                self.connection.settimeout(self.timeout)
+        if not self.raw_requestline:
+            self.close_connection = 1
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            self.close_connection = 1
+            return
+
+        if not self.parse_request():
+            return
+        if not self.server.keepalive:
+            self.close_connection = 1
+
+        environ = self.get_environ()
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        stdin = LimitedInput(self.rfile, length)
+        handler = KeepAliveServerHandler(stdin, self.wfile, self.get_stderr(),
+                                         environ)
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+        if not stdin.discard():
+            self.close_connection = 1
+
+
+class WSGIServer(simple_server.WSGIServer):
+    """
+    Single threaded server, handling one connection at a time.
+    """
+    engine = 'simple'
+    request_queue_size = 64
+
+    def __init__(self, server_address, handler_class=KeepAliveRequestHandler,
+                 keepalive=5, request_timeout=30, **kwargs):
+        self.keepalive = keepalive
+        self.request_timeout = request_timeout
+        self.stopping = False
+        simple_server.WSGIServer.__init__(self, server_address, handler_class)
+
+    def stop(self):
+        """
+        Stops accepting new connections. May be called from a signal handler.
+        """
+        self.stopping = True
+        # shutdown() blocks until serve_forever() returns, which happens in
+        # the thread that is being interrupted.
+        stopper = threading.Thread(target=self.shutdown)
+        stopper.daemon = True
+        stopper.start()
+
+
+class ThreadPoolWSGIServer(WSGIServer):
+    """
+    Server which hands each connection to a fixed pool of worker threads.
+    """
+    engine = 'threaded'
+
+    def __init__(self, server_address, handler_class=KeepAliveRequestHandler,
+                 workers=10, **kwargs):
+        WSGIServer.__init__(self, server_address, handler_class, **kwargs)
+        self.workers = workers
+        self._queue = Queue(workers * 4)
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work,
+                                      name='yubiadmin-worker-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        self._queue.put((request, client_address))
+
+    def server_close(self):
+        WSGIServer.server_close(self)
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(SHUTDOWN_TIMEOUT)
+
+
+class PreforkWSGIServer(WSGIServer):
+    """
+    Server which forks a number of worker processes that accept connections
+    from a shared listening socket. Dead workers are replaced.
+    """
+    engine = 'prefork'
+
+    def __init__(self, server_address, handler_class=KeepAliveRequestHandler,
+                 workers=4, **kwargs):
+        WSGIServer.__init__(self, server_address, handler_class, **kwargs)
+        self.workers = workers
+        self._children = set()
+        self._is_child = False
+        # Workers which lose the race for a connection must not block.
+        self.socket.setblocking(0)
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            self._is_child = True
+            self._children = set()
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, lambda *args: WSGIServer.stop(self))
+            try:
+                WSGIServer.serve_forever(self)
+            except:
+                log.exception('Worker process %d failed', os.getpid())
+                os._exit(1)
+            os._exit(0)
+        self._children.add(pid)
+
+    def serve_forever(self, poll_interval=0.5):
+        for i in range(self.workers):
+            self._spawn()
+        while self._children:
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    break
+                raise
+            self._children.discard(pid)
+            if not self.stopping:
+                log.warning('Worker process %d exited (%d), restarting', pid,
+                            status)
+                self._spawn()
+
+    def stop(self):
+        self.stopping = True
+        if self._is_child:
+            return WSGIServer.stop(self)
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+
+ENGINES = {
+    'simple': WSGIServer,
+    'threaded': ThreadPoolWSGIServer,
+    'prefork': PreforkWSGIServer,
+}
+
+
+def make_server(host, port, app, engine='threaded', workers=10, keepalive=5,
+                request_timeout=30, handler_class=KeepAliveRequestHandler):
+    if engine not in ENGINES:
+        raise ValueError('Unknown server engine: %s' % engine)
+    httpd = ENGINES[engine]((host, port), handler_class, workers=workers,
+                            keepalive=keepalive,
+                            request_timeout=request_timeout)
+    httpd.set_app(app)
+    return httpd
+
+
+def serve(httpd):
+    """
+    Serves requests until SIGTERM or SIGINT is received, then stops accepting
+    connections and lets in-flight requests finish before returning.
+    """
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *args: httpd.stop())
+    log.info('Serving on %s:%d (%s)', httpd.server_name, httpd.server_port,
+             httpd.engine)
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+    log.info('Server stopped')
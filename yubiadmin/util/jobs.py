@@ -0,0 +1,336 @@
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import time
+import errno
+import logging
+import binascii
+import threading
+import subprocess
+from collections import deque, OrderedDict
+from yubiadmin.config import settings
+from yubiadmin.util.system import service_command, stats
+
+__all__ = [
+    'Job',
+    'JobError',
+    'JobCancelled',
+    'JobQueue',
+    'run_service',
+    'jobs'
+]
+
+log = logging.getLogger(__name__)
+
+
+class JobError(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job(object):
+    """
+    A unit of work run by a JobQueue. The function is called with the job as
+    its first argument, which it can use to run commands, report progress and
+    check for cancellation.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+    # Bytes of output to keep, older output is dropped.
+    max_output = 65536
+
+    def __init__(self, name, func, args=(), key=None, delay=0):
+        self.id = binascii.hexlify(os.urandom(8))
+        self.name = name
+        self.func = func
+        self.args = args
+        self.key = key
+        self.state = Job.QUEUED
+        self.progress = None
+        self.error = None
+        self.created = time.time()
+        self.not_before = self.created + delay
+        self.started = None
+        self.finished = None
+        self._output = deque()
+        self._output_size = 0
+        self._cancelled = threading.Event()
+        self._proc = None
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.state in (Job.DONE, Job.FAILED, Job.CANCELLED)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def output(self):
+        with self._lock:
+            return ''.join(self._output)
+
+    def write(self, data):
+        with self._lock:
+            self._output.append(data)
+            self._output_size += len(data)
+            while self._output_size > self.max_output and \
+                    len(self._output) > 1:
+                self._output_size -= len(self._output.popleft())
+
+    def check(self):
+        """
+        Raises JobCancelled if the job has been cancelled.
+        """
+        if self.cancelled:
+            raise JobCancelled()
+
+    def call(self, args, env=None):
+        """
+        Runs a command, adding its output to that of the job, and returns its
+        exit status. The command is killed if the job is cancelled.
+        """
+        self.check()
+        self.write('$ %s\n' % ' '.join(args))
+        start = time.time()
+        try:
+            proc = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, close_fds=True,
+                                    env=env)
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.EACCES):
+                self.write('%s\n' % e)
+                return 127
+            raise
+        self._proc = proc
+        try:
+            # cancel() may have been called before _proc was set.
+            if self.cancelled:
+                proc.kill()
+            for line in iter(proc.stdout.readline, ''):
+                self.write(line)
+            proc.wait()
+        finally:
+            self._proc = None
+            stats.record(args, time.time() - start)
+        self.check()
+        return proc.returncode
+
+    def cancel(self):
+        self._cancelled.set()
+        proc = self._proc
+        if proc is not None:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+
+    def run(self):
+        self.state = Job.RUNNING
+        self.started = time.time()
+        try:
+            self.func(self, *self.args)
+            self.state = Job.DONE
+        except JobCancelled:
+            self.state = Job.CANCELLED
+        except Exception as e:
+            log.exception('Job %s (%s) failed', self.name, self.id)
+            self.error = str(e)
+            self.state = Job.FAILED
+        self.finished = time.time()
+        log.info('Job %s (%s) %s in %.3fs', self.name, self.id, self.state,
+                 self.finished - self.started)
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'state': self.state,
+            'done': self.done,
+            'progress': self.progress,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'output': self.output
+        }
+
+
+class JobQueue(object):
+    """
+    Runs jobs in a fixed number of worker threads, in the order they were
+    submitted. Jobs sharing a key, such as the name of a service, never run
+    at the same time. The most recent finished jobs are kept, so that their
+    status and output can be looked up.
+
+    Jobs only live in the process that ran them, so with background set to
+    False, as it is for the prefork engine, each job is instead run within
+    the request submitting it, and is done once submit returns.
+    """
+    def __init__(self, workers=2, history=50, background=True):
+        self.workers = workers
+        self.history = history
+        self.background = background
+        self._jobs = OrderedDict()
+        self._pending = []
+        self._busy_keys = set()
+        self._cond = threading.Condition()
+        self._pid = None
+
+    def submit(self, name, func, args=(), key=None, delay=0):
+        """
+        Queues func to be called with a new Job and args, after at least
+        delay seconds. If an identical job with the same key is still waiting
+        to run, that job is returned instead of queueing another.
+        """
+        if not self.background:
+            return self._run_now(Job(name, func, args, key, delay))
+        with self._cond:
+            for job in self._pending:
+                if key is not None and (job.key, job.name, job.func,
+                                        job.args) == (key, name, func, args):
+                    return job
+            job = Job(name, func, args, key, delay)
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._prune()
+            self._start()
+            self._cond.notify()
+        log.debug('Queued job %s (%s)', name, job.id)
+        return job
+
+    def _run_now(self, job):
+        with self._cond:
+            self._jobs[job.id] = job
+            self._prune()
+        delay = job.not_before - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        job.run()
+        return job
+
+    def get(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def active(self, key):
+        """
+        Returns the most recent unfinished job with the given key, if any.
+        """
+        with self._cond:
+            for job in reversed(self._jobs.values()):
+                if job.key == key and not job.done:
+                    return job
+        return None
+
+    def __iter__(self):
+        with self._cond:
+            return iter(list(reversed(self._jobs.values())))
+
+    def cancel(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return job
+            job.cancel()
+            if job in self._pending:
+                self._pending.remove(job)
+                job.state = Job.CANCELLED
+                job.finished = time.time()
+        return job
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.done]
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job.id]
+
+    def _start(self):
+        # Threads don't survive a fork, so each process starts its own.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work,
+                                          name='jobs-%d' % i)
+                thread.daemon = True
+                thread.start()
+
+    def _next(self):
+        """
+        Returns the next job which may run now, or None and the number of
+        seconds to wait before checking again.
+        """
+        now = time.time()
+        wait = None
+        for job in self._pending:
+            if job.key is not None and job.key in self._busy_keys:
+                continue
+            if job.not_before > now:
+                delay = job.not_before - now
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            self._pending.remove(job)
+            if job.key is not None:
+                self._busy_keys.add(job.key)
+            return job, None
+        return None, wait
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job, wait = self._next()
+                while job is None:
+                    self._cond.wait(wait)
+                    job, wait = self._next()
+            try:
+                job.run()
+            finally:
+                with self._cond:
+                    self._busy_keys.discard(job.key)
+                    self._prune()
+                    # Jobs waiting for this key may now run.
+                    self._cond.notify_all()
+
+
+def run_service(job, script, cmd):
+    """
+    Job function running an init script command.
+    """
+    status = job.call(service_command(script, cmd))
+    if status != 0:
+        raise JobError('%s %s failed with status %d' % (script, cmd, status))
+
+
+jobs = JobQueue(settings['job_workers'])
@@ -0,0 +1,218 @@
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import time
+import threading
+from webob import Response
+
+__all__ = [
+    'Counter',
+    'Histogram',
+    'MetricRegistry',
+    'MetricsMiddleware',
+    'metrics'
+]
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+# Seconds, suitable for page loads as well as running commands.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=''):
+    pairs = ['%s="%s"' % (name, _escape(value))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """
+    Base class for metrics, keeping a value for each combination of label
+    values, which are given in the order of label_names.
+    """
+    type = None
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.description),
+                 '# TYPE %s %s' % (self.name, self.type)]
+        with self._lock:
+            items = sorted(self._values.items())
+            for labels, value in items:
+                lines.extend(self._samples(labels, value))
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self, labels, value):
+        return ['%s%s %s' % (self.name,
+                             _format_labels(self.label_names, labels),
+                             _format_value(value))]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, description, label_names=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, description, label_names)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, labels=()):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # One count per bucket, followed by the sum.
+                counts = self._values[labels] = [0] * len(self.buckets) + [0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def time(self, labels=()):
+        return _Timer(self, labels)
+
+    def _samples(self, labels, counts):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets, counts):
+            total += count
+            lines.append('%s_bucket%s %d' % (
+                self.name, _format_labels(self.label_names, labels,
+                                          'le="%s"' % _format_value(bound)),
+                total))
+        formatted = _format_labels(self.label_names, labels)
+        lines.append('%s_sum%s %s' % (self.name, formatted,
+                                      _format_value(float(counts[-1]))))
+        lines.append('%s_count%s %d' % (self.name, formatted, total))
+        return lines
+
+
+class _Timer(object):
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.time() - self.start, self.labels)
+
+
+class MetricRegistry(object):
+    """
+    Holds all metrics, and renders them in the Prometheus text format. Each
+    server process has its own metrics.
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, description, label_names=()):
+        metric = Counter(name, description, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, description, label_names=(), **kwargs):
+        metric = Histogram(name, description, label_names, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def __call__(self, environ, start_response):
+        response = Response(self.render(), content_type=CONTENT_TYPE,
+                            charset=None)
+        response.cache_control = 'no-cache'
+        return response(environ, start_response)
+
+
+metrics = MetricRegistry()
+
+request_seconds = metrics.histogram(
+    'yubiadmin_request_duration_seconds',
+    'Time taken to handle requests, including rendering the page.',
+    ('app', 'section'))
+responses = metrics.counter(
+    'yubiadmin_responses_total', 'Responses sent, by status code.',
+    ('app', 'code'))
+
+
+class MetricsMiddleware(object):
+    """
+    Records the time taken and status of each request handled by app. The app
+    and section which handled the request are taken from the
+    yubiadmin.app and yubiadmin.section keys of the environ.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        status = []
+
+        def _start_response(status_line, headers, exc_info=None):
+            status.append(status_line.split(None, 1)[0])
+            return start_response(status_line, headers, exc_info)
+
+        start = time.time()
+        try:
+            return self.app(environ, _start_response)
+        finally:
+            app = environ.get('yubiadmin.app', '')
+            request_seconds.observe(time.time() - start, (
+                app, environ.get('yubiadmin.section', '')))
+            responses.inc((app, status[0] if status else '500'))
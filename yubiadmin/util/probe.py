@@ -0,0 +1,179 @@
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import time
+import logging
+from threading import Thread, Lock
+from collections import OrderedDict
+
+__all__ = [
+    'Probe',
+    'ProbeRegistry',
+    'probe',
+    'probes'
+]
+
+log = logging.getLogger(__name__)
+
+
+class Probe(object):
+    """
+    Caches the result of an expensive status check, such as running a
+    command. While it is being read, the probe is kept up to date in the
+    background by the registry, so reading it never has to wait for the check
+    itself.
+    """
+    def __init__(self, name, func, ttl):
+        self.name = name
+        self.func = func
+        self.ttl = ttl
+        self.value = None
+        self.error = None
+        self.updated = None
+        self.duration = None
+        self.read = None
+        self.refreshing = False
+        self._invalid = False
+        self._lock = Lock()
+
+    @property
+    def age(self):
+        if self.updated is None:
+            return None
+        return time.time() - self.updated
+
+    @property
+    def expired(self):
+        return self.updated is None or self.age >= self.ttl
+
+    @property
+    def in_use(self):
+        """
+        True if the probe has been read within the last ttl seconds.
+        """
+        return self.read is not None and time.time() - self.read < self.ttl
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def refresh(self):
+        with self._lock:
+            self._invalid = False
+            start = time.time()
+            try:
+                self.value = self.func()
+                self.error = None
+            except Exception as e:
+                # Keep the last known value.
+                log.exception('Probe %s failed', self.name)
+                self.error = e
+            finally:
+                self.refreshing = False
+            self.updated = time.time()
+            self.duration = self.updated - start
+        return self.value
+
+    def invalidate(self):
+        """
+        Makes the next read run the check, instead of returning the cached
+        value.
+        """
+        self._invalid = True
+
+    def get(self):
+        self.read = time.time()
+        if self.updated is None or self._invalid:
+            self.refresh()
+        probes.start()
+        return self.value
+
+    __call__ = get
+
+
+class ProbeRegistry(object):
+    """
+    Keeps track of all probes, and runs a thread refreshing the ones that are
+    in use once they expire. Each refresh runs in a thread of its own, so that
+    a check which hangs only holds up its own probe.
+    """
+    def __init__(self, interval=1):
+        self.interval = interval
+        self._probes = OrderedDict()
+        self._thread = None
+        self._pid = None
+        self._lock = Lock()
+
+    def register(self, name, func, ttl):
+        probe = self._probes[name] = Probe(name, func, ttl)
+        return probe
+
+    def __getitem__(self, name):
+        return self._probes[name]
+
+    def __iter__(self):
+        return iter(self._probes.values())
+
+    def invalidate(self):
+        for probe in self:
+            probe.invalidate()
+
+    def start(self):
+        # Threads don't survive fork(), so check the pid as well.
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = Thread(target=self._run,
+                                      name='probe-refresher')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            for probe in self:
+                if probe.updated is not None and probe.expired and \
+                        probe.in_use and not probe.refreshing:
+                    probe.refreshing = True
+                    thread = Thread(target=probe.refresh,
+                                    name='probe-%s' % probe.name)
+                    thread.daemon = True
+                    thread.start()
+            time.sleep(self.interval)
+
+
+probes = ProbeRegistry()
+
+
+def probe(name, ttl):
+    """
+    Decorator turning a function into a Probe, registered under name, which
+    returns the cached result of the function when called.
+    """
+    def decorator(func):
+        return probes.register(name, func, ttl)
+    return decorator
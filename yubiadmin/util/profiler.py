@@ -0,0 +1,191 @@
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import time
+import heapq
+import pstats
+import marshal
+import logging
+import binascii
+import cProfile
+import threading
+from StringIO import StringIO
+from webob import Request, Response, exc
+
+__all__ = [
+    'ProfileStore',
+    'ProfilerMiddleware'
+]
+
+log = logging.getLogger(__name__)
+
+PARAM = '_profile'
+HEADER = 'X-Profile'
+TOP_FUNCTIONS = 40
+
+
+def format_stats(stats, limit=TOP_FUNCTIONS):
+    """
+    Returns the functions taking the most cumulative time, as text.
+    """
+    out = StringIO()
+    stats = pstats.Stats(stats, stream=out)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
+
+
+class Profile(object):
+    """
+    The stats of a profiled request, which can be passed to pstats.Stats.
+    """
+    def __init__(self, path, elapsed, stats):
+        self.id = binascii.hexlify(os.urandom(6))
+        self.path = path
+        self.elapsed = elapsed
+        self.created = time.time()
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+    @property
+    def data(self):
+        """The stats in the format written by pstats.Stats.dump_stats."""
+        return marshal.dumps(self.stats)
+
+
+class ProfileStore(object):
+    """
+    Keeps the size slowest profiles, and serves them: /profiles lists them,
+    and /profiles/<id> downloads one in pstats format, or shows its top
+    functions with ?format=text.
+    """
+    def __init__(self, size=10):
+        self.size = size
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def add(self, profile):
+        with self._lock:
+            entry = (profile.elapsed, profile.id, profile)
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, entry)
+            elif entry > self._heap[0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def get(self, profile_id):
+        for (_, _, profile) in self._heap:
+            if profile.id == profile_id:
+                return profile
+        return None
+
+    def __iter__(self):
+        with self._lock:
+            entries = sorted(self._heap, reverse=True)
+        return iter([profile for (_, _, profile) in entries])
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        request.path_info_pop()
+        profile_id = request.path_info_pop()
+        if not profile_id:
+            response = Response(''.join(
+                '%s %8.1fms %s %s\n' % (
+                    p.id, p.elapsed * 1000,
+                    time.strftime('%Y-%m-%d %H:%M:%S',
+                                  time.localtime(p.created)), p.path)
+                for p in self), content_type='text/plain')
+        else:
+            profile = self.get(profile_id)
+            if profile is None:
+                response = exc.HTTPNotFound()
+            elif request.params.get('format') == 'text':
+                response = Response(format_stats(profile),
+                                    content_type='text/plain')
+            else:
+                response = Response(
+                    profile.data, content_type='application/octet-stream',
+                    content_disposition='attachment; filename='
+                    'yubiadmin-%s.pstats' % profile.id)
+        return response(environ, start_response)
+
+
+class ProfilerMiddleware(object):
+    """
+    Profiles requests which ask for it, using the _profile parameter or the
+    X-Profile header, and adds the profiles to store. Given the value "show",
+    the top functions are returned in place of the response. Otherwise the
+    response is returned as usual, with the profile id in the X-Profile
+    header.
+    """
+    def __init__(self, app, store):
+        self.app = app
+        self.store = store
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        mode = request.GET.get(PARAM, request.headers.get(HEADER))
+        if mode is None:
+            return self.app(environ, start_response)
+        if PARAM in request.GET:
+            # Keep the parameter from the app, which may take any parameters
+            # as a form submission. This updates QUERY_STRING.
+            del request.GET[PARAM]
+
+        captured = []
+
+        def _start_response(status, headers, exc_info=None):
+            captured[:] = [status, headers]
+            return lambda data: body.append(data)
+
+        def run():
+            app_iter = self.app(environ, _start_response)
+            try:
+                body.extend(app_iter)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+
+        body = []
+        profiler = cProfile.Profile()
+        start = time.time()
+        profiler.runcall(run)
+        elapsed = time.time() - start
+        profiler.create_stats()
+        profile = Profile(request.path_qs, elapsed, profiler.stats)
+        self.store.add(profile)
+        log.info('Profiled %s in %.3fs as %s', request.path_qs, elapsed,
+                 profile.id)
+
+        if mode == 'show':
+            response = Response(format_stats(profiler),
+                                content_type='text/plain')
+            return response(environ, start_response)
+        status, headers = captured
+        start_response(status, headers + [(HEADER, profile.id)])
+        return body
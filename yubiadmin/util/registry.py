@@ -0,0 +1,153 @@
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import time
+import threading
+from collections import OrderedDict
+
+__all__ = [
+    'AppInfo',
+    'AppRegistry',
+    'app_doc',
+    'parse_doc'
+]
+
+
+def parse_doc(doc, default):
+    """
+    Splits a docstring into a title, its first line, and a description, the
+    rest of it. Both are default if there is no docstring.
+    """
+    if doc:
+        doc = doc.strip()
+        if '\n' in doc:
+            title, desc = doc.split('\n', 1)
+            return title, desc.strip()
+        return doc, doc
+    return default, default
+
+
+def app_doc(app):
+    """
+    Returns the title and description of an app, from its docstring.
+    """
+    return parse_doc(app.__doc__, app.__class__.__name__)
+
+
+class AppInfo(object):
+    """
+    Metadata for an app, which is computed once, along with its last known
+    disabled and hidden state.
+    """
+    def __init__(self, app):
+        self._app = app
+        self.name = app.name
+        self.priority = app.priority
+        if getattr(app, 'title', None):
+            self.title, self.description = app.title, app.description
+        else:
+            self.title, self.description = app_doc(app)
+        self.disabled = False
+        self.hidden = False
+
+    @property
+    def app(self):
+        """
+        The app itself. Apps which are described by an object with a load()
+        method, are loaded on first use.
+        """
+        load = getattr(self._app, 'load', None)
+        return load() if load else self._app
+
+    def refresh(self):
+        self.disabled = bool(getattr(self._app, 'disabled', False))
+        self.hidden = bool(getattr(self._app, 'hidden', False))
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'title': self.title,
+            'description': self.description,
+            'disabled': self.disabled,
+            'hidden': self.hidden
+        }
+
+
+class AppRegistry(object):
+    """
+    Apps by name. The disabled and hidden state of the apps, which may
+    involve checking the file system, is re-evaluated at most once every
+    interval seconds, or on the next lookup after invalidate().
+    """
+    def __init__(self, apps, interval=10):
+        self.interval = interval
+        self._apps = OrderedDict()
+        for app in sorted(apps, key=lambda app: (app.priority, app.name)):
+            self._apps[app.name] = AppInfo(app)
+        self._checked = None
+        self._snapshot = ([], ())
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._checked = None
+
+    def _fresh(self):
+        checked = self._checked
+        return checked is not None and time.time() - checked < self.interval
+
+    def _check(self):
+        if self._fresh():
+            return
+        with self._lock:
+            if self._fresh():
+                return  # Refreshed by another thread.
+            for info in self._apps.values():
+                info.refresh()
+            self._snapshot = (
+                [info.as_dict() for info in self._apps.values()],
+                tuple((info.name, info.disabled, info.hidden)
+                      for info in self._apps.values()))
+            self._checked = time.time()
+
+    def __iter__(self):
+        self._check()
+        return iter(self._apps.values())
+
+    def get(self, name):
+        self._check()
+        return self._apps.get(name)
+
+    def snapshot(self):
+        """
+        Returns a list of dicts describing all apps, and a tuple of their
+        state which can be used as a cache key.
+        """
+        self._check()
+        return self._snapshot
+
+    def enabled(self):
+        return [info.app for info in self if not info.disabled]
@@ -25,23 +25,191 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import os
+import time
+import errno
+import logging
+import threading
 import subprocess
+from yubiadmin.util.metrics import metrics
 
 __all__ = [
     'run',
-    'invoke_rc_d'
+    'call',
+    'stream',
+    'which',
+    'pid_running',
+    'service_command',
+    'invoke_rc_d',
+    'stats'
 ]
 
+log = logging.getLogger(__name__)
+
+process_seconds = metrics.histogram(
+    'yubiadmin_subprocess_duration_seconds',
+    'Time spent running commands, by command.', ('command',))
+
+MAX_OUTPUT = 1 << 20
+
+
+class ProcessStats(object):
+    """
+    Counts spawned processes and the time spent waiting for them, in total
+    and for the request being handled by the current thread.
+    """
+    def __init__(self):
+        self.spawned = 0
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def begin_request(self):
+        self._local.spawned = 0
+        self._local.elapsed = 0.0
+
+    @property
+    def request_spawned(self):
+        return getattr(self._local, 'spawned', 0)
+
+    @property
+    def request_elapsed(self):
+        return getattr(self._local, 'elapsed', 0.0)
+
+    def record(self, args, elapsed):
+        log.debug('Ran %r in %.3fs', args, elapsed)
+        with self._lock:
+            self.spawned += 1
+            self.elapsed += elapsed
+        self._local.spawned = self.request_spawned + 1
+        self._local.elapsed = self.request_elapsed + elapsed
+        process_seconds.observe(elapsed, (os.path.basename(args[0]),))
+
+
+stats = ProcessStats()
+
+
+def _kill(proc):
+    try:
+        proc.kill()
+    except OSError:
+        pass
+
+
+def _read(stream, limit):
+    chunks = []
+    size = 0
+    while True:
+        chunk = stream.read(8192)
+        if not chunk:
+            break
+        # Keep draining past the limit, so that the process isn't blocked.
+        if limit is None or size < limit:
+            chunks.append(chunk)
+            size += len(chunk)
+    output = ''.join(chunks)
+    return output if limit is None else output[:limit]
+
+
+def call(args, timeout=None, limit=None, env=None):
+    """
+    Runs a command given as a list of arguments, without a shell.
+    Returns the exit status and stdout, cut off after limit bytes if given.
+    A missing executable gives status 127, and a timeout kills the process.
+    """
+    start = time.time()
+    try:
+        with open(os.devnull, 'w') as devnull:
+            proc = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                    stderr=devnull, close_fds=True, env=env)
+    except OSError as e:
+        if e.errno in (errno.ENOENT, errno.EACCES):
+            log.error('Unable to run %r: %s', args, e)
+            return 127, ''
+        raise
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, _kill, args=(proc,))
+        timer.start()
+    try:
+        output = _read(proc.stdout, limit)
+        proc.wait()
+    finally:
+        if timer:
+            timer.cancel()
+        stats.record(args, time.time() - start)
+    return proc.returncode, output
+
+
+def stream(args, timeout=None, env=None, stderr=True, check=False):
+    """
+    Runs a command given as a list of arguments, yielding its output line by
+    line as it is produced. stderr is included in the output unless stderr is
+    False. The process is killed if the generator is closed before the command
+    is done. If check is True, a non-zero exit status raises
+    subprocess.CalledProcessError once the output ends.
+    """
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT if stderr
+                                else devnull, close_fds=True, env=env)
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, _kill, args=(proc,))
+        timer.start()
+    try:
+        for line in iter(proc.stdout.readline, ''):
+            yield line
+        proc.wait()
+        if check and proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, args[0])
+    finally:
+        if timer:
+            timer.cancel()
+        if proc.returncode is None:
+            _kill(proc)
+            proc.wait()
+        stats.record(args, time.time() - start)
+
 
 def run(cmd):
-    p = subprocess.Popen(['sh', '-c', cmd], stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-    output = p.communicate()
-    return p.returncode, output[0]
+    """
+    Runs a shell command line. Prefer call() unless shell features are needed.
+    """
+    return call(['sh', '-c', cmd], limit=MAX_OUTPUT)
 
 
-def invoke_rc_d(script, cmd):
-    if run('which invoke-rd.d')[0] == 0:
-        return run('invoke-rc.d %s %s' % (script, cmd))
+def which(name):
+    for path in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        filename = os.path.join(path, name)
+        if os.path.isfile(filename) and os.access(filename, os.X_OK):
+            return filename
+    return None
+
+
+def pid_running(pidfile):
+    """
+    Checks if the process whose pid is stored in pidfile is running.
+    """
+    try:
+        with open(pidfile, 'r') as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+    except (IOError, ValueError):
+        return False
+    except OSError as e:
+        # EPERM means that the process exists.
+        return e.errno == errno.EPERM
+    return True
+
+
+def service_command(script, cmd):
+    if which('invoke-rc.d'):
+        return ['invoke-rc.d', script, cmd]
     else:
-        return run('/etc/init.d/%s %s' % (script, cmd))
+        return ['/etc/init.d/%s' % script, cmd]
+
+
+def invoke_rc_d(script, cmd):
+    return call(service_command(script, cmd), limit=MAX_OUTPUT)
@@ -0,0 +1,262 @@
+# Copyright (c) 2013 Yubico AB
+# All rights reserved.
+#
+#   Redistribution and use in source and binary forms, with or
+#   without modification, are permitted provided that the following
+#   conditions are met:
+#
+#    1. Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#    2. Redistributions in binary form must reproduce the above
+#       copyright notice, this list of conditions and the following
+#       disclaimer in the documentation and/or other materials provided
+#       with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import time
+import json
+import errno
+import select
+import struct
+import logging
+import threading
+from webob import Request, Response
+from yubiadmin.config import settings
+
+__all__ = [
+    'Watcher',
+    'watcher'
+]
+
+log = logging.getLogger(__name__)
+
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                        use_errno=True)
+    _libc.inotify_init1
+    _libc.inotify_add_watch
+except (ImportError, OSError, AttributeError):
+    _libc = None
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_IGNORED = 0x8000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+    IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+EVENT = struct.Struct('iIII')
+
+
+def signature(path):
+    """
+    Identifies a version of a file, or None if it doesn't exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+
+def _existing_dir(path):
+    """
+    The directory containing path, or its closest existing ancestor.
+    """
+    dirname = os.path.dirname(path)
+    while dirname and not os.path.isdir(dirname):
+        parent = os.path.dirname(dirname)
+        if parent == dirname:
+            break
+        dirname = parent
+    return dirname or os.curdir
+
+
+class Inotify(object):
+    """
+    Watches directories for changes using the Linux inotify API.
+    """
+    def __init__(self):
+        self.fd = _libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs = {}
+        self._wds = {}
+
+    def add(self, dirname):
+        if dirname in self.dirs:
+            return True
+        wd = _libc.inotify_add_watch(self.fd, dirname.encode('utf-8')
+                                     if isinstance(dirname, unicode)
+                                     else dirname, WATCH_MASK)
+        if wd < 0:
+            log.warning('Unable to watch %s: %s', dirname,
+                        os.strerror(ctypes.get_errno()))
+            return False
+        self.dirs[dirname] = wd
+        self._wds[wd] = dirname
+        return True
+
+    def read(self, timeout):
+        """
+        Waits up to timeout seconds for events, returning True if there were
+        any.
+        """
+        try:
+            if not select.select([self.fd], [], [], timeout)[0]:
+                return False
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return False
+            raise
+        data = os.read(self.fd, 65536)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size + length
+            if mask & IN_IGNORED and wd in self._wds:
+                # The directory is gone, and will be watched again once it
+                # or an ancestor changes.
+                del self.dirs[self._wds.pop(wd)]
+        return True
+
+
+class Watcher(object):
+    """
+    Notices when watched files are created, changed or removed, and calls
+    the subscribed callbacks with their paths. Directories holding the files
+    are watched using inotify, where available, and all files are also
+    checked every interval seconds, which is all that is done without
+    inotify.
+
+    Pages remember the version of each file they were rendered from, and ask
+    /changes which of them have changed since. Versions are derived from the
+    files themselves, so any server process can answer.
+    """
+    def __init__(self, interval=5):
+        self.interval = interval
+        self._paths = {}
+        self._subscribers = []
+        self._inotify = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def watch(self, path):
+        if path not in self._paths:
+            with self._lock:
+                self._paths.setdefault(path, signature(path))
+        self._start()
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def version(self, path):
+        """
+        Returns a string identifying the current version of path.
+        """
+        current = signature(path)
+        return '%r:%d:%d' % current if current else ''
+
+    def changed(self, versions):
+        """
+        Given a dict of paths to versions, returns the watched paths which
+        have changed.
+        """
+        return [path for path, version in versions.items()
+                if path in self._paths and self.version(path) != version]
+
+    def check(self):
+        """
+        Compares all watched files to their last known state, and publishes
+        any changes.
+        """
+        changed = []
+        with self._lock:
+            for path, known in self._paths.items():
+                current = signature(path)
+                if current != known:
+                    self._paths[path] = current
+                    changed.append(path)
+        for path in changed:
+            log.info('%s changed', path)
+            for callback in self._subscribers:
+                try:
+                    callback(path)
+                except Exception:
+                    log.exception('Handling change to %s failed', path)
+        return changed
+
+    def _start(self):
+        # Threads don't survive a fork, so each process starts its own.
+        if self._pid == os.getpid() or not self.interval:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._inotify = None
+            if _libc is not None:
+                try:
+                    self._inotify = Inotify()
+                except OSError as e:
+                    log.warning('Not using inotify: %s', e)
+            thread = threading.Thread(target=self._run, name='watcher')
+            thread.daemon = True
+            thread.start()
+
+    def _add_watches(self):
+        inotify = self._inotify
+        if inotify is not None:
+            for dirname in set(map(_existing_dir, list(self._paths))):
+                inotify.add(dirname)
+
+    def _run(self):
+        while True:
+            try:
+                self._add_watches()
+                if self._inotify is not None:
+                    self._inotify.read(self.interval)
+                else:
+                    time.sleep(self.interval)
+                self.check()
+            except Exception:
+                log.exception('Watching files failed')
+                time.sleep(self.interval)
+
+    def __call__(self, environ, start_response):
+        """
+        Tells a page which of the files it was rendered from have changed,
+        given path and version parameters for each file.
+        """
+        request = Request(environ)
+        versions = dict(zip(request.params.getall('path'),
+                            request.params.getall('version')))
+        response = Response(json.dumps({'changed': self.changed(versions)}),
+                            content_type='application/json')
+        response.cache_control = 'no-cache'
+        return response(environ, start_response)
+
+
+watcher = Watcher(settings['watch_interval'])